@@ -1,33 +1,117 @@
-#--- Creating NetCDF file with WLDAS soil moisture (coarsened) for full 2001-2020 domain
-#------ Using dask dashboard to monitor progress
+#--- Creating NetCDF file with WLDAS soil moisture (coarsened) for 2001-2020 over the American Southwest
+#------ Using dask dashboard to monitor progress (or the streaming engine without a cluster)
+#------ Set previous_moisture_path to only coarsen new or changed days onto an earlier run
+#------ Coarser pyramid levels are in groups, e.g. xr.open_dataset(path, group="level_24")
+#------ Optionally saved as a chunked, compressed Zarr store instead (same groups)
 
 import xarray as xr
+import pandas as pd
+import numpy as np
 from datetime import datetime
-import glob
+import json
+import os
+import sys
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import time
+import netCDF4
 from dask.distributed import Client
+import file_catalog
+import reference_index
+import processed_store
 
 def main():
     start = time.time()
 
-    #--- Get moisture for date range
-    wldas_path = "/mnt/data2/jturner/wldas_data"
+    #--- Get moisture for date range (WLDAS files listed in file_catalog.py)
     start_date = "20010101"
     end_date = "20210101"
 
-    with Client(dashboard_address="127.0.0.1:8787") as client:
-        print(client)
-        #--- Combine and coarsen dataset
-        moisture_dataset = create_moisture_dataset(wldas_path, start_date, end_date)
-
-        #--- Save dataset
-        print("Saving processed files as NetCDF...")
-        timestamp = datetime.today().strftime("%Y-%m-%d")
-        processed_wldas_path = f"DATA/processed/1_moisture_grid_{timestamp}.nc"
-        print(moisture_dataset.chunks)
-        moisture_dataset.to_netcdf(processed_wldas_path)
-        print(f"Saved wldas set to {processed_wldas_path}")
-    
+    #--- Only pixels in this region are read from WLDAS (None for the full domain)
+    region = "American Southwest"
+
+    #--- Sub-grid statistics of each coarse pixel, all computed from one read of WLDAS
+    #------ mean is saved as SoilMoi00_10cm_tavg, the others as SoilMoi00_10cm_tavg_<statistic>
+    statistics = ["mean", "min", "max", "std", "valid_fraction"]
+
+    #--- Coarsening factors of the moisture pyramid, each built from the previous level
+    #------ The first level is saved at the root of the NetCDF file, the others in groups "level_<factor>"
+    #------ Full resolution (1) runs out of memory for the whole record, 6 is the publication grid
+    pyramid_levels = [6, 12, 24]
+
+    #--- Previously processed moisture grid to extend (None for a full rebuild)
+    previous_moisture_path = None
+
+    #--- Open WLDAS through the kerchunk reference index instead of every file header
+    use_reference_index = True
+
+    #--- "dask" builds one graph for the whole record on a dask cluster
+    #------ "stream" decodes, coarsens and writes a batch of days at a time without a cluster,
+    #------ keeping peak memory within memory_budget_gb (full rebuilds only)
+    #------ "pool" streams a contiguous block of days in each of n_workers processes (full rebuilds only)
+    engine = "dask"
+    memory_budget_gb = 8
+    n_workers = 32
+
+    #--- "netcdf" or "zarr" (a directory store, the pool workers write their days into it directly)
+    #------ Chunks follow how the grid is read: "map" (whole maps for a few days),
+    #------ "time_series" (the whole record on small tiles) or "balanced" (see processed_store.py)
+    output_format = "netcdf"
+    access = "balanced"
+
+    timestamp = datetime.today().strftime("%Y-%m-%d")
+    processed_wldas_path = processed_store.get_output_path(
+        f"DATA/processed/1_moisture_grid_{timestamp}.nc", output_format
+    )
+
+    entries = get_wldas_files(start_date, end_date)
+    sources = get_source_manifest(entries)
+
+    if engine in ("stream", "pool"):
+        if previous_moisture_path is not None:
+            print(f"The {engine} engine only does full rebuilds, use the dask engine to extend a grid. Exiting...")
+            sys.exit()
+
+        if engine == "stream":
+            stream_moisture_dataset(
+                entries, processed_wldas_path, region=region, statistics=statistics,
+                pyramid_levels=pyramid_levels, use_reference_index=use_reference_index,
+                memory_budget_gb=memory_budget_gb, output_format=output_format, access=access,
+            )
+        else:
+            pool_moisture_dataset(
+                entries, processed_wldas_path, region=region, statistics=statistics,
+                pyramid_levels=pyramid_levels, use_reference_index=use_reference_index,
+                memory_budget_gb=memory_budget_gb, n_workers=n_workers,
+                output_format=output_format, access=access,
+            )
+    else:
+        with Client(dashboard_address="127.0.0.1:8787") as client:
+            print(client)
+
+            #--- Combine and coarsen dataset
+            if previous_moisture_path is None:
+                moisture_dataset = create_moisture_dataset(
+                    entries, region=region, statistics=statistics,
+                    pyramid_levels=pyramid_levels, use_reference_index=use_reference_index,
+                )
+            else:
+                moisture_dataset = update_moisture_dataset(
+                    previous_moisture_path, entries, sources, region=region, statistics=statistics,
+                    pyramid_levels=pyramid_levels, use_reference_index=use_reference_index,
+                )
+                sources = {**read_source_manifest(previous_moisture_path), **sources}
+            moisture_pyramid = create_moisture_pyramid(moisture_dataset, pyramid_levels, statistics)
+
+            #--- Save dataset
+            print(f"Saving processed files as {output_format}...")
+            print(moisture_dataset.chunks)
+            write_moisture_pyramid(moisture_pyramid, processed_wldas_path, output_format, access)
+
+    write_source_manifest(processed_wldas_path, sources)
+    print(f"Saved wldas set to {processed_wldas_path}")
+
     end = time.time()
     print(f"Time to process: {end - start:.2f} seconds")
 
@@ -35,47 +119,498 @@ def main():
 
 #------------------------
 
-def create_moisture_dataset(wldas_path, start_date, end_date):
-    print("Opening WLDAS files for each date...")
-
+def get_wldas_files(start_date, end_date):
+    print("Querying WLDAS file catalog...")
     start = datetime.strptime(start_date, "%Y%m%d")
     end = datetime.strptime(end_date, "%Y%m%d")
 
-    files = glob.glob(f"{wldas_path}/WLDAS_NOAHMP001_DA1_*.nc.SUB.nc4")
+    entries = file_catalog.query_files("wldas", start, end)
 
-    selected = []
-    for f in files:
-        date_str = f.split("_DA1_")[1][:8]
-        file_date = datetime.strptime(date_str, "%Y%m%d")
+    return entries
 
-        if start <= file_date <= end:
-            selected.append(f)
+def open_wldas_dataset(entries, region=None, pyramid_levels=(6,), use_reference_index=True):
+    #--- Aligned to the coarsest level so every level matches a full domain run
+    window = get_region_window(region, pyramid_levels[-1], pyramid_levels[-1])
 
-    selected = sorted(selected)
+    print("Opening WLDAS files for each date...")
 
-    print(f"Combining {len(selected)} WLDAS files...")    
-    wldas_dataset = xr.open_mfdataset(
-        selected,
-        combine="by_coords",
-        drop_variables="time_bnds",
-        chunks="auto",
-    )
+    print(f"Combining {len(entries)} WLDAS files...")
+    if use_reference_index:
+        wldas_dataset = reference_index.open_reference_dataset(
+            "wldas",
+            entries,
+            drop_variables="time_bnds",
+            chunks="auto",
+        )
+        wldas_dataset = wldas_dataset.isel(window)
+    else:
+        #--- Slice inside each file read so pixels outside the region are never decoded
+        wldas_dataset = file_catalog.open_catalog_dataset(
+            "wldas",
+            entries,
+            drop_variables="time_bnds",
+            chunks="auto",
+            preprocess=lambda ds: ds.isel(window),
+        )
 
     wldas_dataset = wldas_dataset['SoilMoi00_10cm_tavg']
+
+    return wldas_dataset
+
+def create_moisture_dataset(entries, region=None, statistics=("mean",), pyramid_levels=(6,),
+                            use_reference_index=True):
+    wldas_dataset = open_wldas_dataset(entries, region, pyramid_levels, use_reference_index)
     wldas_dataset = wldas_dataset.chunk({"lon": 200, "lat": 200, "time": 100})
 
-    #--- Coarsen resolution for wldas_set
-    COARSEN_LAT = 6
-    COARSEN_LON = 6
-    wldas_dataset_coarse = (
-        wldas_dataset
-        .coarsen(lat=COARSEN_LAT, lon=COARSEN_LON, boundary="trim")
-        .mean()
-    )
+    #--- Coarsen resolution for wldas_set to the first pyramid level
+    wldas_dataset_coarse = coarsen_statistics(wldas_dataset, pyramid_levels[0], pyramid_levels[0], statistics)
+    _set_moisture_attrs(wldas_dataset_coarse, region, pyramid_levels)
 
     return wldas_dataset_coarse
 
+def stream_moisture_dataset(entries, processed_wldas_path, region=None, statistics=("mean",), pyramid_levels=(6,),
+                            use_reference_index=True, memory_budget_gb=8, scheduler="threads",
+                            output_format="netcdf", access="balanced", store_offset=None):
+    '''
+    Decode, coarsen and append a batch of days at a time to the output file, so peak memory
+    stays within the budget whatever the record length. Same output as the dask engine.
+    With store_offset, the days are instead written into an existing zarr store from that time index.
+    '''
+    wldas_dataset = open_wldas_dataset(entries, region, pyramid_levels, use_reference_index)
+
+    #--- Raw batch, its valid mask and one temporary per statistic are held at once
+    day_bytes = wldas_dataset.sizes["lat"] * wldas_dataset.sizes["lon"] * wldas_dataset.dtype.itemsize
+    batch_days = max(1, int(memory_budget_gb * 1e9 // (day_bytes * (2 + len(statistics)))))
+    n_days = wldas_dataset.sizes["time"]
+    print(f"Streaming {n_days} days in batches of {batch_days}...")
+
+    if store_offset is None:
+        #--- Chunks are set for the whole record, the first batch only covers part of it
+        coarse = coarsen_statistics(wldas_dataset, pyramid_levels[0], pyramid_levels[0], statistics)
+        pyramid_chunks = get_pyramid_chunks(create_moisture_pyramid(coarse, pyramid_levels, statistics), access)
+        tmp_path = f"{processed_wldas_path}.tmp"
+
+    for i in range(0, n_days, batch_days):
+        batch = wldas_dataset.isel(time=slice(i, i + batch_days))
+        batch = batch.chunk({"lon": 200, "lat": 200, "time": -1})
+
+        #--- Same reductions as the dask engine, computed locally so the batch is read once
+        batch_coarse = coarsen_statistics(batch, pyramid_levels[0], pyramid_levels[0], statistics)
+        batch_coarse = batch_coarse.compute(scheduler=scheduler)
+        _set_moisture_attrs(batch_coarse, region, pyramid_levels)
+        batch_pyramid = create_moisture_pyramid(batch_coarse, pyramid_levels, statistics)
+
+        if store_offset is not None:
+            _write_pyramid_region(batch_pyramid, processed_wldas_path, store_offset + i)
+        elif i == 0:
+            _write_pyramid_levels(batch_pyramid, tmp_path, output_format, pyramid_chunks, unlimited_dims=["time"])
+        else:
+            _append_pyramid_levels(batch_pyramid, tmp_path, output_format)
+        print(f"Wrote days {i + 1}-{min(i + batch_days, n_days)} of {n_days}")
+
+        del batch, batch_coarse, batch_pyramid
+
+    if store_offset is None:
+        processed_store.replace_path(tmp_path, processed_wldas_path)
+
+    return
+
+def pool_moisture_dataset(entries, processed_wldas_path, region=None, statistics=("mean",), pyramid_levels=(6,),
+                          use_reference_index=True, memory_budget_gb=8, n_workers=32,
+                          output_format="netcdf", access="balanced"):
+    '''
+    Stream one contiguous block of days per worker process, then join the parts along time.
+    For zarr the workers write their blocks straight into one store instead of part files.
+    The memory budget is shared between the workers.
+    '''
+    if use_reference_index:
+        #--- Rebuilt here if stale, so the workers don't race to write it
+        reference_index.open_reference_dataset("wldas")
+
+    if output_format == "zarr":
+        #--- Store metadata and coordinates are written up front, the data is filled in by the workers
+        wldas_dataset = open_wldas_dataset(entries, region, pyramid_levels, use_reference_index)
+        coarse = coarsen_statistics(wldas_dataset, pyramid_levels[0], pyramid_levels[0], statistics)
+        _set_moisture_attrs(coarse, region, pyramid_levels)
+        template = create_moisture_pyramid(coarse, pyramid_levels, statistics)
+        pyramid_chunks = get_pyramid_chunks(template, access)
+
+        tmp_path = f"{processed_wldas_path}.tmp"
+        _write_pyramid_levels(template, tmp_path, output_format, pyramid_chunks, compute=False)
+
+        #--- Blocks are whole time chunks, so no two workers write to the same chunk
+        time_chunk = pyramid_chunks[pyramid_levels[0]]["time"]
+        offsets = np.cumsum([0] + [entry["n_time"] for entry in entries])[:-1]
+        chunk_index = offsets // time_chunk
+        blocks = [
+            np.nonzero(np.isin(chunk_index, chunk_block))[0]
+            for chunk_block in np.array_split(np.unique(chunk_index), n_workers)
+        ]
+        blocks = [block for block in blocks if len(block)]
+        targets = [(tmp_path, int(offsets[block[0]])) for block in blocks]
+    else:
+        parts_dir = f"{processed_wldas_path}.parts"
+        os.makedirs(parts_dir, exist_ok=True)
+        blocks = [block for block in np.array_split(np.arange(len(entries)), n_workers) if len(block)]
+        part_paths = [f"{parts_dir}/part_{i:03d}.nc" for i in range(len(blocks))]
+        targets = [(part_path, None) for part_path in part_paths]
+
+    print(f"Processing {len(entries)} WLDAS files in {len(blocks)} worker processes...")
+    #--- Workers are spawned rather than forked, the parent may hold dask and HDF5 state
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                stream_moisture_dataset,
+                [entries[i] for i in block],
+                target_path,
+                region=region,
+                statistics=statistics,
+                pyramid_levels=pyramid_levels,
+                use_reference_index=use_reference_index,
+                memory_budget_gb=memory_budget_gb / n_workers,
+                scheduler="synchronous",
+                store_offset=store_offset,
+            )
+            for block, (target_path, store_offset) in zip(blocks, targets)
+        ]
+        for future in futures:
+            future.result()
+
+    if output_format == "zarr":
+        processed_store.replace_path(tmp_path, processed_wldas_path)
+        return
+
+    print("Joining worker parts...")
+    moisture_pyramid = {}
+    for factor in pyramid_levels:
+        group = None if factor == pyramid_levels[0] else f"level_{factor}"
+        moisture_pyramid[factor] = xr.open_mfdataset(part_paths, group=group, combine="nested", concat_dim="time")
+    write_moisture_pyramid(moisture_pyramid, processed_wldas_path, output_format, access)
+
+    for level in moisture_pyramid.values():
+        level.close()
+    shutil.rmtree(parts_dir)
+
+    return
+
+def _set_moisture_attrs(wldas_dataset_coarse, region, pyramid_levels):
+    wldas_dataset_coarse.attrs["region"] = region if region is not None else "Full domain"
+    wldas_dataset_coarse.attrs["coarsen_factor"] = pyramid_levels[0]
+    wldas_dataset_coarse.attrs["pyramid_levels"] = list(pyramid_levels)
+    return
+
+def coarsen_statistics(wldas_dataset, coarsen_lat, coarsen_lon, statistics):
+    '''
+    Reduce each coarsening block with every requested statistic, stored as separate variables.
+    All statistics share the same source chunks, so the raw data is only read once.
+    '''
+    name = wldas_dataset.name
+    blocks = wldas_dataset.coarsen(lat=coarsen_lat, lon=coarsen_lon, boundary="trim")
+
+    coarse = {}
+    for statistic in statistics:
+        if statistic == "mean":
+            coarse_statistic = blocks.mean()
+        elif statistic == "min":
+            coarse_statistic = blocks.min()
+        elif statistic == "max":
+            coarse_statistic = blocks.max()
+        elif statistic == "std":
+            coarse_statistic = blocks.std()
+        elif statistic == "valid_fraction":
+            valid = wldas_dataset.notnull().astype("float32")
+            coarse_statistic = valid.coarsen(lat=coarsen_lat, lon=coarsen_lon, boundary="trim").mean()
+        else:
+            raise ValueError(f"Unknown coarsening statistic: {statistic}")
+
+        coarse[get_statistic_name(name, statistic)] = coarse_statistic
+
+    return xr.Dataset(coarse)
+
+def get_statistic_name(name, statistic):
+    return name if statistic == "mean" else f"{name}_{statistic}"
+
+def create_moisture_pyramid(moisture_dataset, pyramid_levels, statistics):
+    '''
+    Build each coarser level from the previous one, returned as {factor: dataset}.
+    '''
+    if len(pyramid_levels) > 1 and "valid_fraction" not in statistics:
+        raise ValueError("valid_fraction is needed to weight the coarser pyramid levels")
+    if "std" in statistics and "mean" not in statistics and len(pyramid_levels) > 1:
+        raise ValueError("mean is needed to combine std in the coarser pyramid levels")
+
+    print(f"Building moisture pyramid for coarsening factors {list(pyramid_levels)}...")
+    pyramid = {pyramid_levels[0]: moisture_dataset}
+    for finer_factor, factor in zip(pyramid_levels[:-1], pyramid_levels[1:]):
+        if factor % finer_factor != 0:
+            raise ValueError(f"Pyramid level {factor} is not a multiple of {finer_factor}")
+
+        coarse = coarsen_pyramid_level(pyramid[finer_factor], factor // finer_factor, statistics)
+        coarse.attrs = {**moisture_dataset.attrs, "coarsen_factor": factor}
+        pyramid[factor] = coarse
+
+    return pyramid
+
+def coarsen_pyramid_level(finer, factor, statistics, name="SoilMoi00_10cm_tavg"):
+    '''
+    Combine the sub-grid statistics of the finer level over factor x factor blocks.
+    mean and std are weighted by the valid fraction, so they match coarsening the WLDAS pixels directly.
+    '''
+    def blocks(da):
+        return da.coarsen(lat=factor, lon=factor, boundary="trim")
+
+    valid = finer[get_statistic_name(name, "valid_fraction")]
+    weight = blocks(valid).sum()
+
+    coarse = {}
+    if "mean" in statistics:
+        mean = blocks((finer[name] * valid).fillna(0)).sum() / weight
+
+    for statistic in statistics:
+        finer_statistic = finer[get_statistic_name(name, statistic)]
+
+        if statistic == "mean":
+            coarse_statistic = mean
+        elif statistic == "min":
+            coarse_statistic = blocks(finer_statistic).min()
+        elif statistic == "max":
+            coarse_statistic = blocks(finer_statistic).max()
+        elif statistic == "std":
+            second_moment = (finer_statistic**2 + finer[name]**2) * valid
+            second_moment = blocks(second_moment.fillna(0)).sum() / weight
+            coarse_statistic = np.sqrt((second_moment - mean**2).clip(min=0))
+        elif statistic == "valid_fraction":
+            coarse_statistic = blocks(finer_statistic).mean()
+        else:
+            raise ValueError(f"Unknown coarsening statistic: {statistic}")
+
+        coarse[get_statistic_name(name, statistic)] = coarse_statistic.astype(finer_statistic.dtype)
+
+    return xr.Dataset(coarse)
+
+def get_region_window(region, coarsen_lat, coarsen_lon):
+    '''
+    Index slices of the WLDAS grid covering the region, aligned to the coarsening blocks
+    so the coarse pixels are the same as in a full domain run.
+    '''
+    if region is None:
+        return {}
+
+    lat_min, lat_max, lon_min, lon_max = _get_coords_for_region(region)
+    grid = file_catalog.get_catalog_grid("wldas")
+    window = {
+        "lat": _get_aligned_slice(grid["lat"], lat_min, lat_max, coarsen_lat),
+        "lon": _get_aligned_slice(grid["lon"], lon_min, lon_max, coarsen_lon),
+    }
+    return window
+
+def _get_aligned_slice(coord, coord_min, coord_max, factor):
+    inside = np.nonzero((coord >= coord_min) & (coord <= coord_max))[0]
+    start = inside[0] // factor * factor
+    stop = -(-(inside[-1] + 1) // factor) * factor
+    stop = min(stop, len(coord) // factor * factor)
+    return slice(start, stop)
+
+def update_moisture_dataset(previous_moisture_path, entries, sources, region=None, statistics=("mean",),
+                            pyramid_levels=(6,), use_reference_index=True):
+    print(f"Opening previous moisture grid from {previous_moisture_path}...")
+    previous_dataset = xr.open_dataset(previous_moisture_path, chunks={"time": 100})
+
+    region_name = region if region is not None else "Full domain"
+    if previous_dataset.attrs.get("region", "Full domain") != region_name:
+        print(f"Previous moisture grid is not for {region_name}, run a full rebuild instead. Exiting...")
+        sys.exit()
+
+    if list(np.atleast_1d(previous_dataset.attrs.get("pyramid_levels", [6]))) != list(pyramid_levels):
+        print(f"Previous moisture grid was not built with pyramid levels {list(pyramid_levels)}, "
+              "run a full rebuild instead. Exiting...")
+        sys.exit()
+
+    expected_vars = {get_statistic_name("SoilMoi00_10cm_tavg", statistic) for statistic in statistics}
+    if set(previous_dataset.data_vars) != expected_vars:
+        print(f"Previous moisture grid has {sorted(previous_dataset.data_vars)}, "
+              f"expected {sorted(expected_vars)}, run a full rebuild instead. Exiting...")
+        sys.exit()
+    previous_sources = read_source_manifest(previous_moisture_path)
+
+    #--- Days are matched on the file date, changed files are matched on size and mtime
+    processed_days = set(previous_dataset.indexes["time"].normalize())
+    new_entries = []
+    changed_days = []
+    for entry in entries:
+        file_date = pd.Timestamp(entry["start"]).normalize()
+        name = os.path.basename(entry["path"])
+
+        if file_date not in processed_days:
+            new_entries.append(entry)
+        elif name in previous_sources and previous_sources[name] != sources[name]:
+            new_entries.append(entry)
+            changed_days.append(file_date)
+
+    print(f"Found {len(new_entries) - len(changed_days)} new and {len(changed_days)} changed WLDAS files.")
+    if not new_entries:
+        return previous_dataset
+
+    if changed_days:
+        keep = ~previous_dataset.indexes["time"].normalize().isin(changed_days)
+        previous_dataset = previous_dataset.isel(time=keep)
+
+    new_dataset = create_moisture_dataset(
+        new_entries, region=region, statistics=statistics,
+        pyramid_levels=pyramid_levels, use_reference_index=use_reference_index,
+    )
+
+    moisture_dataset = xr.concat([previous_dataset, new_dataset], dim="time")
+    if not moisture_dataset.indexes["time"].is_monotonic_increasing:
+        moisture_dataset = moisture_dataset.sortby("time")
+
+    return moisture_dataset
+
+def get_source_manifest(entries):
+    '''
+    Size and modification time of each WLDAS file, used to detect changed inputs on the next run.
+    '''
+    sources = {}
+    for entry in entries:
+        sources[os.path.basename(entry["path"])] = [entry["size"], entry["mtime"]]
+    return sources
+
+def _get_manifest_path(processed_wldas_path):
+    return f"{os.path.splitext(processed_wldas_path)[0]}.sources.json"
+
+def read_source_manifest(processed_wldas_path):
+    manifest_path = _get_manifest_path(processed_wldas_path)
+    if not os.path.exists(manifest_path):
+        print(f"No source manifest at {manifest_path}, only new days will be added.")
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def write_source_manifest(processed_wldas_path, sources):
+    with open(_get_manifest_path(processed_wldas_path), "w") as f:
+        json.dump(sources, f)
+    return
+
+def _get_coords_for_region(location_name):
+    """
+    Get the lat and lon range from the dictionary of regions used in Line 2025. 
+    """
+    locations = {
+        "American Southwest": [(43, -124), (25, -97)],
+        
+        "Chihuahua": [(33.3, -110.0), (28.0, -105.3)],
+        "West Texas": [(35.0, -104.0), (31.8, -100.5)],
+        "Central High Plains": [(43.0, -105.0), (36.5, -98.0)],
+        "Nevada": [(43.0, -120.7), (37.0, -114.5)],
+        "Utah": [(42.0, -114.5), (37.5, -109.0)],
+        "Southern California": [(37.0, -119.0), (30.0, -114.2)],
+        "Four Corners": [(37.5, -112.5), (34.4, -107.0)],
+        "San Luis Valley": [(38.5, -106.5), (37.0, -105.3)],
+
+        "N Mexico 1": [(31.8, -107.6), (31.3, -107.1)],
+        "Carson Sink": [(40.1, -118.75), (39.6, -118.25)],
+        "N Mexico 2": [(31.4, -108.25), (30.9, -107.75)],
+        "N Mexico 3": [(31.1, -107.15), (30.6, -106.65)],
+        "Black Rock 1": [(41.15, -119.35), (40.65, -118.85)],
+        "West Texas 1": [(32.95, -102.35), (32.45, -101.85)],
+        "N Mexico 4": [(30.65, -107.65), (30.15, -107.15)],
+        "N Mexico 5": [(31.0, -106.65), (30.5, -106.15)],
+        "White Sands": [(33.15, -106.6), (32.65, -106.1)],
+        "West Texas 2": [(33.5, -102.8), (33.0, -102.30)],
+        "SLV2": [(38.05, -106.15), (37.55, -105.65)],
+        "N Mexico 6": [(29.55, -107.05), (29.05, -106.55)],
+        "NE AZ": [(35.7, -111.1), (35.2, -110.6)],
+        "NW New Mexico": [(36.15, -108.85), (35.65, -108.35)],
+        "Black Rock 2": [(40.75, -119.9), (40.25, -119.4)],
+        "N Mexico 7": [(30.9, -108.15), (30.4, -107.65)],
+    }
+    coords = locations[location_name]
+    lats = [p[0] for p in coords]
+    lons = [p[1] for p in coords]
+
+    lat_min, lat_max = min(lats), max(lats)
+    lon_min, lon_max = min(lons), max(lons)
+
+    return lat_min, lat_max, lon_min, lon_max
+
+def write_moisture_pyramid(moisture_pyramid, processed_wldas_path, output_format="netcdf", access="balanced"):
+    #--- Written to a temporary path first, the previous grid may be the same path and still open
+    tmp_path = f"{processed_wldas_path}.tmp"
+    _write_pyramid_levels(moisture_pyramid, tmp_path, output_format, get_pyramid_chunks(moisture_pyramid, access))
+    processed_store.replace_path(tmp_path, processed_wldas_path)
+    return
+
+def get_pyramid_chunks(moisture_pyramid, access="balanced"):
+    '''
+    Chunks of each pyramid level for the access pattern. Every level uses the time chunks
+    of the first one, so a block of days covers whole chunks in all of them.
+    '''
+    pyramid_levels = list(moisture_pyramid)
+    time_chunk = processed_store.get_chunks(moisture_pyramid[pyramid_levels[0]], access)["time"]
+
+    pyramid_chunks = {}
+    for factor in pyramid_levels:
+        chunks = processed_store.get_chunks(moisture_pyramid[factor], access)
+        pyramid_chunks[factor] = {**chunks, "time": time_chunk}
+    return pyramid_chunks
+
+def _write_pyramid_levels(moisture_pyramid, path, output_format="netcdf", pyramid_chunks=None,
+                          unlimited_dims=None, compute=True):
+    pyramid_levels = list(moisture_pyramid)
+    if pyramid_chunks is None:
+        pyramid_chunks = get_pyramid_chunks(moisture_pyramid)
+
+    for factor in pyramid_levels:
+        first = factor == pyramid_levels[0]
+        processed_store.write_dataset(
+            moisture_pyramid[factor], path, output_format,
+            chunks=pyramid_chunks[factor],
+            group=None if first else f"level_{factor}",
+            mode="w" if first else "a",
+            unlimited_dims=unlimited_dims,
+            compute=compute,
+        )
+    return
+
+def _write_pyramid_region(moisture_pyramid, path, region_start):
+    pyramid_levels = list(moisture_pyramid)
+
+    for factor in pyramid_levels:
+        group = None if factor == pyramid_levels[0] else f"level_{factor}"
+        processed_store.write_region(moisture_pyramid[factor], path, region_start, group=group)
+    return
+
+def _append_pyramid_levels(moisture_pyramid, path, output_format="netcdf"):
+    '''
+    Append each level along the time dimension of a file or store from _write_pyramid_levels.
+    '''
+    pyramid_levels = list(moisture_pyramid)
+
+    if output_format == "zarr":
+        for factor in pyramid_levels:
+            group = None if factor == pyramid_levels[0] else f"level_{factor}"
+            processed_store.append_dataset(moisture_pyramid[factor], path, group=group)
+        return
+
+    with netCDF4.Dataset(path, "a") as nc:
+        #--- Groups share the unlimited time dimension of the root group
+        n_written = nc.variables["time"].shape[0]
+
+        for factor in pyramid_levels:
+            group = nc if factor == pyramid_levels[0] else nc.groups[f"level_{factor}"]
+            level = moisture_pyramid[factor]
+            n_new = level.sizes["time"]
+
+            time_var = group.variables["time"]
+            times = level.indexes["time"].to_pydatetime()
+            time_var[n_written:n_written + n_new] = netCDF4.date2num(times, time_var.units, time_var.calendar)
+
+            for name, da in level.data_vars.items():
+                values = da.transpose(*group.variables[name].dimensions).values
+                group.variables[name][n_written:n_written + n_new] = np.ma.masked_invalid(values)
+    return
+
 #------------------------
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
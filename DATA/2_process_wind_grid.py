@@ -0,0 +1,395 @@
+#--- NetCDF files with daytime max wind speeds from 2001-2020 for the American Southwest
+#------ One engine for every wind source (NARR, ERA5, ERA5-Land, ERA5 gusts), each described in wind_adapters.py
+#------ All sources in wind_sources are built in one run, sharing the dask cluster or worker pool
+#--- Saved at DATA/processed/2_wind_grid_<source>_<date>.nc
+
+import xarray as xr
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from dask.distributed import Client
+import time
+import os
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import dask
+import file_catalog
+import processed_store
+import wind_adapters
+
+LAND_MASK_PATH = "/mnt/data2/jturner/narr/land.nc"
+
+def main(): 
+    start = time.time()
+
+    #--- Wind sources to build (keys of wind_adapters.WIND_SOURCES)
+    wind_sources = ["narr"]
+
+    #--- Daily statistics of the daytime winds, all from one pass over the hourly data
+    #------ max is saved as wind_speed, the others as wind_speed_mean, wind_speed_hour_of_max
+    #------ and wind_speed_hours_above_<threshold> (daytime hours at or above each threshold, m/s)
+    statistics = ["max", "mean", "hour_of_max", "hours_above"]
+    thresholds = [8, 10, 12]
+
+    #--- "dask" builds one graph for all sources on a dask cluster
+    #------ "pool" reduces a contiguous block of days per task in n_workers processes and joins the parts
+    engine = "dask"
+    n_workers = 32
+
+    #--- "netcdf" or "zarr" (the pool workers write their days into the store directly)
+    #------ Chunks follow how the grid is read: "map", "time_series" or "balanced" (see processed_store.py)
+    output_format = "netcdf"
+    access = "balanced"
+
+    timestamp = datetime.today().strftime("%Y-%m-%d")
+    processed_wind_paths = {
+        source: processed_store.get_output_path(
+            f"DATA/processed/2_wind_grid_{source}_{timestamp}.nc", output_format
+        )
+        for source in wind_sources
+    }
+
+    if engine == "pool":
+        pool_daily_wind(processed_wind_paths, statistics, thresholds, n_workers, output_format, access)
+    else:
+        with Client(dashboard_address="127.0.0.1:8787") as client:
+            print(client)
+
+            #--- Writes are computed together, so the sources share one pass over the cluster
+            writes = []
+            for source, processed_wind_path in processed_wind_paths.items():
+                ds_daily = get_daily_wind_dataset(source, statistics, thresholds)
+                writes.append(
+                    save_wind_dataset(ds_daily, processed_wind_path, output_format, access, compute=False)
+                )
+            dask.compute(*writes)
+
+    for source, processed_wind_path in processed_wind_paths.items():
+        print(f"Saved {source} winds to {processed_wind_path}")
+
+    end = time.time()
+    print(f"Time to process: {end - start:.2f} seconds")
+
+    return
+
+#------------------------
+
+def get_daily_wind_dataset(source, statistics=("max",), thresholds=(), time_start=None, time_end=None):
+    '''
+    Daily daytime wind statistics of a source, optionally for the hourly times between time_start and time_end (inclusive).
+    '''
+    wind_source = wind_adapters.WIND_SOURCES[source]
+    ds_ws = wind_adapters.get_wind_speeds(source, squared=True)
+    if time_start is not None or time_end is not None:
+        ds_ws = ds_ws.sel(time=slice(time_start, time_end))
+
+    if wind_source["crop_to_land"]:
+        print("Cropping to American Southwest...")
+        crop_index = get_crop_index("American Southwest")
+        ds_ws = ds_ws.isel(y=crop_index["y"], x=crop_index["x"])
+
+    ds_daily = get_daily_wind_statistics(ds_ws, wind_source["daytime_hours"], statistics, thresholds)
+
+    if wind_source["crop_to_land"]:
+        print("Cropping to land mask...")
+        ds_daily = ds_daily.where(xr.DataArray(crop_index["keep"], dims=("y", "x")))
+
+    return ds_daily
+
+def get_daily_wind_statistics(ds_ws, daytime_hours=(0, 12, 15, 18, 21), statistics=("max",), thresholds=()):
+    '''
+    Statistics of the daytime winds of each day, all reduced from one days x hours view of the hourly data.
+    With wind_speed_squared the square root is taken after the max and the threshold counts
+    (neither changes under it), only the mean needs the square root of every value.
+    '''
+    ds_daytime = get_daytime_hours(ds_ws, daytime_hours)
+    step_hours = ds_daytime.attrs["step_hours"]
+    if "wind_speed_squared" in ds_ws:
+        daytime = ds_daytime["wind_speed_squared"]
+        power = 2
+    else:
+        daytime = ds_daytime["wind_speed"]
+        power = 1
+
+    def to_speed(da):
+        return np.sqrt(da) if power == 2 else da
+
+    valid = daytime.notnull().any("hour")
+
+    ds_daily = {}
+    for statistic in statistics:
+        if statistic == "max":
+            ds_daily["wind_speed"] = to_speed(daytime.max("hour"))
+        elif statistic == "mean":
+            ds_daily["wind_speed_mean"] = to_speed(daytime).mean("hour")
+        elif statistic == "hour_of_max":
+            #--- UTC hour of the (first) daytime max
+            max_index = daytime.fillna(-np.inf).argmax("hour")
+            hours = daytime["hour"].values.astype("float32")
+            hour_of_max = xr.apply_ufunc(
+                lambda index: hours[index], max_index, dask="parallelized", output_dtypes=["float32"]
+            )
+            ds_daily["wind_speed_hour_of_max"] = hour_of_max.where(valid)
+        elif statistic == "hours_above":
+            #--- Daytime hours at or above each threshold, every time step counting for its length (3 h for NARR)
+            for threshold in thresholds:
+                hours_above = ((daytime >= threshold**power).sum("hour") * step_hours).astype("float32")
+                ds_daily[f"wind_speed_hours_above_{threshold:g}"] = hours_above.where(valid)
+        else:
+            raise ValueError(f"Unknown daily wind statistic: {statistic}")
+
+    return xr.Dataset(ds_daily)
+
+def get_daytime_hours(ds_ws, daytime_hours):
+    '''
+    Daytime values of each day as dimensions (time, hour), 00 UTC counting towards the day before.
+    The hours are picked by position and reshaped, so the hourly cube is never sorted or resampled.
+    Gaps in the time axis are filled with NaN first. The time step in hours is kept as the step_hours attribute.
+    '''
+    print(f"Getting daytime winds ({', '.join(f'{hour:02d}' for hour in daytime_hours)} UTC)...")
+    times = ds_ws.indexes["time"]
+    step = pd.Timedelta(np.diff(times.values).min())
+    regular = pd.date_range(times[0], times[-1], freq=step)
+    if len(regular) != len(times) or not times.equals(regular):
+        print("Filling gaps in the time axis with NaN...")
+        ds_ws = ds_ws.reindex(time=regular)
+
+    daytime_slots = get_daytime_slots(ds_ws.indexes["time"], daytime_hours)
+    if daytime_slots is None:
+        raise ValueError("Daytime hours are not on the time axis, or it is not aligned to 00 UTC")
+    lead, trail, positions, days, hours = daytime_slots
+
+    #--- Partial days at the record edges are padded with NaN up to whole days
+    ds_ws = ds_ws.drop_vars("time")
+    if lead or trail:
+        ds_ws = ds_ws.pad(time=(lead, trail))
+    ds_daytime = ds_ws.isel(time=positions)
+
+    ds_daytime = ds_daytime.coarsen(time=len(hours)).construct(time=("time", "hour"))
+    ds_daytime = ds_daytime.assign_coords(time=days + pd.Timedelta(hours=12), hour=hours)
+    ds_daytime.attrs["step_hours"] = step / pd.Timedelta(hours=1)
+
+    return ds_daytime
+
+def get_daytime_slots(times, daytime_hours):
+    '''
+    Index arithmetic for a regular time axis: NaN padding before and after the record to whole days,
+    the positions of the daytime hours of each day in the padded axis, the days and the hours.
+    None if the time axis is not aligned to 00 UTC or has none of the hours.
+    '''
+    step = times[1] - times[0] if len(times) > 1 else pd.Timedelta(hours=1)
+    day = pd.Timedelta(days=1)
+    if day % step or (times[0] - times[0].normalize()) % step:
+        return None
+    n_slots = day // step
+
+    #--- A day runs from one step after 00 UTC up to 00 UTC the next day
+    first_day = (times[0] - step).normalize()
+    last_day = (times[-1] - step).normalize()
+    lead = (times[0] - first_day) // step - 1
+    trail = (last_day + day - times[-1]) // step
+
+    hours = sorted(
+        (hour for hour in daytime_hours if pd.Timedelta(hours=hour) % step == pd.Timedelta(0)),
+        key=lambda hour: hour or 24,
+    )
+    slots = [(pd.Timedelta(hours=hour or 24)) // step - 1 for hour in hours]
+    if not slots:
+        return None
+
+    #--- Edge days without any recorded daytime hour are dropped, as resample would
+    days = pd.date_range(first_day, last_day, freq="D")
+    day_index = np.arange(len(days))
+    if slots[-1] < lead:
+        day_index = day_index[1:]
+    if slots[0] > n_slots - 1 - trail:
+        day_index = day_index[:-1]
+
+    positions = (day_index[:, None] * n_slots + np.array(slots)[None, :]).ravel()
+    return lead, trail, positions, days[day_index], hours
+
+def get_crop_index(location_name):
+    '''
+    Rows and columns of the NARR grid covering a region, and which of their pixels are inside it and on land.
+    Cached next to the file catalog, rebuilt if the land mask file changes.
+    '''
+    lat_min, lat_max, lon_min, lon_max = _get_coords_for_region(location_name)
+    key = np.array([os.stat(LAND_MASK_PATH).st_mtime, lat_min, lat_max, lon_min, lon_max])
+
+    crop_index_path = _get_crop_index_path(location_name)
+    if os.path.exists(crop_index_path):
+        with np.load(crop_index_path) as cached:
+            if np.array_equal(cached["key"], key):
+                return {"y": _to_slice(cached["y"]), "x": _to_slice(cached["x"]), "keep": cached["keep"]}
+
+    print(f"Building crop index for {location_name}...")
+    grid = file_catalog.get_catalog_grid("narr_uwnd")
+    lat = grid["lat"]
+    lon = grid["lon"]
+    in_region = (
+        (lat >= lat_min) & (lat <= lat_max) &
+        (lon >= lon_min) & (lon <= lon_max)
+    )
+    y = np.nonzero(in_region.any(axis=1))[0]
+    x = np.nonzero(in_region.any(axis=0))[0]
+
+    with xr.open_dataset(LAND_MASK_PATH) as land_mask:
+        land = land_mask["land"].squeeze("time", drop=True).values.astype(bool)
+    keep = (in_region & land)[np.ix_(y, x)]
+
+    os.makedirs(os.path.dirname(crop_index_path), exist_ok=True)
+    np.savez(crop_index_path, key=key, y=y, x=x, keep=keep)
+
+    return {"y": _to_slice(y), "x": _to_slice(x), "keep": keep}
+
+def _get_crop_index_path(location_name):
+    return f"{file_catalog.CATALOG_DIR}/narr_crop_{location_name.replace(' ', '_')}.npz"
+
+def _to_slice(index):
+    if len(index) and (np.diff(index) == 1).all():
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+def save_wind_dataset(ds_daily, processed_wind_path, output_format="netcdf", access="balanced", compute=True):
+    print(f"Saving to {output_format}...")
+    chunks = processed_store.get_chunks(ds_daily, access)
+    print(chunks)
+    return processed_store.write_dataset(
+        ds_daily, processed_wind_path, output_format, chunks=chunks, compute=compute
+    )
+
+def process_wind_block(source, statistics, thresholds, time_start, time_end, part_path, store_offset=None):
+    '''
+    Daily winds for the hourly times between time_start and time_end (inclusive), written to a part file.
+    With store_offset, the days are instead written into an existing zarr store from that time index.
+    '''
+    ds_daily = get_daily_wind_dataset(source, statistics, thresholds, time_start, time_end)
+
+    #--- One process per block, so no threads inside the worker
+    with dask.config.set(scheduler="synchronous"):
+        if store_offset is not None:
+            processed_store.write_region(ds_daily, part_path, store_offset)
+        else:
+            ds_daily.to_netcdf(part_path)
+
+    return
+
+def pool_daily_wind(processed_wind_paths, statistics=("max",), thresholds=(), n_workers=32,
+                    output_format="netcdf", access="balanced"):
+    '''
+    Split the record of every source into contiguous blocks of days, reduce all blocks in one pool
+    of worker processes, then join the parts of each source along time.
+    For zarr the workers write their blocks straight into one store per source instead of part files.
+    '''
+    tasks = []
+    outputs = {}
+    for source, processed_wind_path in processed_wind_paths.items():
+        #--- Also rebuilds the reference indexes and crop index if stale, so the workers don't race to write them
+        ds_ws = wind_adapters.get_wind_speeds(source)
+        if wind_adapters.WIND_SOURCES[source]["crop_to_land"]:
+            get_crop_index("American Southwest")
+
+        #--- A daytime group runs from 12 UTC to 00 UTC the next day, so blocks start 1 hour after 00 UTC
+        day_groups = (ds_ws.indexes["time"] - pd.Timedelta(hours=1)).normalize().unique()
+
+        if output_format == "zarr":
+            #--- Store metadata and coordinates are written up front, the days are filled in by the workers
+            ds_daily = get_daily_wind_dataset(source, statistics, thresholds)
+            chunks = processed_store.get_chunks(ds_daily, access)
+            tmp_path = f"{processed_wind_path}.tmp"
+            processed_store.write_dataset(ds_daily, tmp_path, output_format, chunks=chunks, compute=False)
+
+            #--- Blocks are whole time chunks of the output days, so no two workers write to the same chunk
+            days = ds_daily.indexes["time"].normalize()
+            time_chunk = chunks["time"]
+            chunk_starts = np.arange(0, len(days), time_chunk)
+            chunk_blocks = [block for block in np.array_split(chunk_starts, n_workers) if len(block)]
+            blocks = [days[block[0]:block[-1] + time_chunk] for block in chunk_blocks]
+            targets = [(tmp_path, int(block[0])) for block in chunk_blocks]
+            outputs[source] = tmp_path
+        else:
+            blocks = [block for block in np.array_split(day_groups, n_workers) if len(block)]
+            parts_dir = f"{processed_wind_path}.parts"
+            os.makedirs(parts_dir, exist_ok=True)
+            part_paths = [f"{parts_dir}/part_{i:03d}.nc" for i in range(len(blocks))]
+            targets = [(part_path, None) for part_path in part_paths]
+            outputs[source] = part_paths
+
+        print(f"Splitting {len(day_groups)} days of {source} into {len(blocks)} blocks...")
+        for block, (target_path, store_offset) in zip(blocks, targets):
+            tasks.append((
+                source,
+                statistics,
+                thresholds,
+                block[0] + pd.Timedelta(hours=1),
+                block[-1] + pd.Timedelta(days=1),
+                target_path,
+                store_offset,
+            ))
+
+    print(f"Processing {len(tasks)} blocks in {n_workers} worker processes...")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(process_wind_block, *task) for task in tasks]
+        for future in futures:
+            future.result()
+
+    for source, processed_wind_path in processed_wind_paths.items():
+        if output_format == "zarr":
+            processed_store.replace_path(outputs[source], processed_wind_path)
+            continue
+
+        print(f"Joining worker parts of {source}...")
+        part_paths = outputs[source]
+        with xr.open_mfdataset(part_paths, combine="nested", concat_dim="time") as ds_daily:
+            save_wind_dataset(ds_daily, processed_wind_path, output_format, access)
+        shutil.rmtree(os.path.dirname(part_paths[0]))
+
+    return
+
+def _get_coords_for_region(location_name):
+    """
+    Get the lat and lon range from the dictionary of regions used in Line 2025. 
+    """
+    locations = {
+        "American Southwest": [(43, -124), (25, -97)],
+        
+        "Chihuahua": [(33.3, -110.0), (28.0, -105.3)],
+        "West Texas": [(35.0, -104.0), (31.8, -100.5)],
+        "Central High Plains": [(43.0, -105.0), (36.5, -98.0)],
+        "Nevada": [(43.0, -120.7), (37.0, -114.5)],
+        "Utah": [(42.0, -114.5), (37.5, -109.0)],
+        "Southern California": [(37.0, -119.0), (30.0, -114.2)],
+        "Four Corners": [(37.5, -112.5), (34.4, -107.0)],
+        "San Luis Valley": [(38.5, -106.5), (37.0, -105.3)],
+
+        "N Mexico 1": [(31.8, -107.6), (31.3, -107.1)],
+        "Carson Sink": [(40.1, -118.75), (39.6, -118.25)],
+        "N Mexico 2": [(31.4, -108.25), (30.9, -107.75)],
+        "N Mexico 3": [(31.1, -107.15), (30.6, -106.65)],
+        "Black Rock 1": [(41.15, -119.35), (40.65, -118.85)],
+        "West Texas 1": [(32.95, -102.35), (32.45, -101.85)],
+        "N Mexico 4": [(30.65, -107.65), (30.15, -107.15)],
+        "N Mexico 5": [(31.0, -106.65), (30.5, -106.15)],
+        "White Sands": [(33.15, -106.6), (32.65, -106.1)],
+        "West Texas 2": [(33.5, -102.8), (33.0, -102.30)],
+        "SLV2": [(38.05, -106.15), (37.55, -105.65)],
+        "N Mexico 6": [(29.55, -107.05), (29.05, -106.55)],
+        "NE AZ": [(35.7, -111.1), (35.2, -110.6)],
+        "NW New Mexico": [(36.15, -108.85), (35.65, -108.35)],
+        "Black Rock 2": [(40.75, -119.9), (40.25, -119.4)],
+        "N Mexico 7": [(30.9, -108.15), (30.4, -107.65)],
+    }
+    coords = locations[location_name]
+    lats = [p[0] for p in coords]
+    lons = [p[1] for p in coords]
+
+    lat_min, lat_max = min(lats), max(lats)
+    lon_min, lon_max = min(lons), max(lons)
+
+    return lat_min, lat_max, lon_min, lon_max
+
+#------------------------
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -7,123 +7,150 @@ import xarray as xr
 import sys, os
 import rioxarray as rxr
 from datetime import datetime
+import processed_store
+import wind_adapters
+import point_sampler
+import dust_events
+import event_clusters
 
 def main():
     location_name = "American Southwest"
     dust_path = "DATA/raw/line_dust/Line_GOES-Dust_Date-LatLon-UTC_2001-2020_Sep2025.csv"
-    dust_df = get_dust_df(dust_path)
+    dust_df = dust_events.get_dust_df(dust_path)
+
+    #--- events within cluster_km and cluster_hours of each other (e.g. one plume reported twice) share a cluster_id
+    cluster_km = 50
+    cluster_hours = 3
+    dust_df = event_clusters.cluster_events(dust_df, cluster_km, cluster_hours)
+
+    #--- k for max/mean/min/valid count of wind and moisture over the k x k pixels around each event, None for only the nearest pixel
+    window = None
 
     #--- wind data
     processed_wind_path = Path("DATA/processed/2_wind_grid_narr_2026-06-15.nc")
-    # dust_df = add_winds_era5_to_dust_df(processed_wind_path, dust_df)
-    dust_df = add_winds_narr_to_dust_df(processed_wind_path, dust_df)
+    # dust_df = add_winds_era5_to_dust_df(processed_wind_path, dust_df, window)
+    dust_df = add_winds_narr_to_dust_df(processed_wind_path, dust_df, window)
     print(f"THIS SHOULD BE 3492: {len(dust_df)}")
 
+    #--- hourly wind at each event's start time, with max and mean over the preceding window_hours
+    dust_df = add_hourly_winds_to_dust_df("narr", dust_df, window_hours=6)
+
     #--- moisture data
     processed_moisture_path = Path("DATA/processed/1_moisture_grid_2026-06-29.nc")
-    dust_df = add_moisture_to_dust_df(processed_moisture_path, dust_df)
+    dust_df = add_moisture_to_dust_df(processed_moisture_path, dust_df, window)
 
     #--- category data
     dust_df = add_static_data(dust_df, location_name)
 
     #--- save dataset
+    table_formats = ["parquet", "csv"]
     timestamp = datetime.today().strftime("%Y-%m-%d")
-    dust_df.to_csv(f"DATA/processed/3_dust_points_vars_{timestamp}.csv", index=False)
+    dtypes = processed_store.get_table_dtypes(dust_df, categories=["usage", "texture", "soil_order"])
+    processed_store.write_table(dust_df, f"DATA/processed/3_dust_points_vars_{timestamp}.parquet", table_formats, dtypes)
 
     return
 
 #------------------------
 
-def get_dust_df(dust_path):
-    print("Opening dust data, creating dust dataframe... ")
-    dust_df = pd.read_csv(dust_path)
-
-    dust_df["time_str"] = (
-        dust_df["start_time_utc"]
-        .astype("Int64")        # allows NaNs safely
-        .astype(str)
-        .str.zfill(4)
-    )
-
-    dust_df["datetime"] = pd.to_datetime(
-        dust_df["date"].astype(str) + dust_df["time_str"],
-        format="%Y%m%d%H%M",
-        utc=True,
-        errors="coerce"
-    )
-
-    n_before = len(dust_df)
-    dust_df = dust_df.dropna(subset=["datetime"]).copy()
-    n_after = len(dust_df)
-    n_removed = n_before - n_after
-    print(f"Removed {n_removed} dust events due to invalid datetime parsing.")
-
-    dust_df["datetime"] = (
-        dust_df["datetime"]
-        .dt.tz_convert(None)
-    )
-    return dust_df
-
-def nearest_grid_point(lat2d, lon2d, lat, lon):
-    dist2 = (lat2d - lat)**2 + (lon2d - lon)**2
-    iy, ix = np.unravel_index(np.argmin(dist2), dist2.shape)
-    return iy, ix
-
-def add_winds_era5_to_dust_df(processed_wind_path, dust_df):
+def add_winds_era5_to_dust_df(processed_wind_path, dust_df, window=None):
 
     if processed_wind_path.exists():
         print("Opening wind speed dataset...")
-        ds_ws = xr.open_dataset(processed_wind_path)
+        ds_ws = processed_store.open_for_query(
+            processed_wind_path, get_daily_wind_times(dust_df), dust_df["latitude"], dust_df["longitude"],
+            match="exact", window=window
+        )
     else:
         print("Wind speed data not found, exiting...")
         sys.exit()
     
     print("For each dust event, getting the wind speed...")
-    dust_winds = []
-    for _, row in dust_df.iterrows():
-        
-        #--- Day-of time match 
-        ws = ds_ws["wind_speed"].sel(
-            time=row["datetime"].normalize() + np.timedelta64(12, "h") #--- Making sure this matches to datetime in wind speed
-        ).sel(
-            latitude=row["latitude"],
-            longitude=row["longitude"],
-            method="nearest"
-        )
-        
-        dust_winds.append(ws.compute().item())
-
-    dust_winds = np.array(dust_winds)
-    dust_df["wind_speed"] = dust_winds
+    dust_df = add_daily_winds(ds_ws, dust_df, window)
 
     return dust_df
 
-def add_winds_narr_to_dust_df(processed_wind_path, dust_df):
+def add_winds_narr_to_dust_df(processed_wind_path, dust_df, window=None):
 
     if processed_wind_path.exists():
         print("Opening wind speed dataset...")
-        ds_ws = xr.open_dataset(processed_wind_path)
+        ds_ws = processed_store.open_for_query(
+            processed_wind_path, get_daily_wind_times(dust_df), dust_df["latitude"], dust_df["longitude"],
+            match="exact", window=window
+        )
     else:
         print("Wind speed data not found, exiting...")
         sys.exit()
     
     print("For each dust event, getting the wind speed...")
-    lat2d = ds_ws["lat"].values
-    lon2d = ds_ws["lon"].values
+    dust_df = add_daily_winds(ds_ws, dust_df, window)
 
-    dust_winds = []
-    for _, row in dust_df.iterrows():
-        iy, ix = nearest_grid_point(lat2d, lon2d, row["latitude"], row["longitude"])
-        
-        #--- Day-of time match 
-        ws = ds_ws["wind_speed"].sel(
-            time=row["datetime"].normalize() + np.timedelta64(12, "h") #--- Making sure this matches to datetime in wind speed
-            ).isel(y=iy, x=ix)
-        
-        dust_winds.append(ws.compute().item())
+    return dust_df
+
+def add_daily_winds(ds_ws, dust_df, window=None):
+    '''
+    Daytime max wind speed of each event's day, sampled for all events at once.
+    Events on days missing from the wind grid are NaN and flagged in wind_missing_date.
+    With a window, also the wind_speed_max/mean/min/count_{k}x{k} columns around each event.
+    '''
+    columns = point_sampler.sample_points(
+        ds_ws, ["wind_speed"], get_daily_wind_times(dust_df), dust_df["latitude"], dust_df["longitude"],
+        match="exact", window=window
+    )
+
+    for name, values in columns.items():
+        if name.startswith("wind_speed"):
+            dust_df[name] = values
+    dust_df["wind_missing_date"] = columns["missing_date"]
+    print(f"Skipped (no matching wind date): {columns['missing_date'].sum()}")
+
+    return dust_df
+
+def get_daily_wind_times(dust_df):
+    #--- Day-of time match 
+    return dust_df["datetime"].dt.normalize() + np.timedelta64(12, "h") #--- Making sure this matches to datetime in wind speed
+
+def add_hourly_winds_to_dust_df(source, dust_df, window_hours=3):
+    '''
+    Wind speed at the time step nearest each event's start time, and its max and mean over the
+    preceding window_hours, read pointwise from the hourly files of a source (wind_adapters.py).
+    Only the chunks holding the event times and pixels are read, never the hourly cube.
+    '''
+    components = wind_adapters.get_wind_components(source, chunks=None)
+    times = components[0].indexes["time"]
+    step = times[1] - times[0]
+
+    print(f"For each dust event, getting the hourly wind speed from {source}...")
+    #--- Events further than one time step from the record are left missing
+    time_index = times.get_indexer(dust_df["datetime"], method="nearest", tolerance=step)
+    lags = np.arange(-(pd.Timedelta(hours=window_hours) // step), 1)
+    window_index = time_index[:, None] + lags[None, :]
+    in_record = (time_index[:, None] >= 0) & (window_index >= 0)
+    window_index = np.where(in_record, window_index, 0)
+
+    space_indexers = point_sampler.get_space_index(components[0], dust_df["latitude"], dust_df["longitude"])
+
+    indexers = {"time": xr.DataArray(window_index, dims=("event", "lag"))}
+    for dim, index in space_indexers.items():
+        indexers[dim] = xr.DataArray(np.broadcast_to(index[:, None], window_index.shape), dims=("event", "lag"))
+
+    values = [component.isel(indexers).values.astype("float64") for component in components]
+    if len(values) == 1:
+        wind_speed = values[0]
+    else:
+        wind_speed = np.sqrt(sum(value**2 for value in values))
+    wind_speed = np.where(in_record, wind_speed, np.nan)
+
+    has_values = np.isfinite(wind_speed).any(axis=1)
+    n_values = np.maximum(np.isfinite(wind_speed).sum(axis=1), 1)
+    dust_df["wind_speed_hourly"] = wind_speed[:, -1]
+    dust_df[f"wind_speed_max_{window_hours}h"] = np.where(
+        has_values, np.where(np.isfinite(wind_speed), wind_speed, -np.inf).max(axis=1), np.nan
+    )
+    dust_df[f"wind_speed_mean_{window_hours}h"] = np.where(
+        has_values, np.nansum(wind_speed, axis=1) / n_values, np.nan
+    )
 
-    dust_winds = np.array(dust_winds)
-    dust_df["wind_speed"] = dust_winds
+    print(f"Events outside the hourly {source} record: {(~in_record[:, -1]).sum()}")
 
     return dust_df
 
@@ -183,49 +210,37 @@ def _get_coords_for_region(location_name):
 
     return lat_min, lat_max, lon_min, lon_max
 
-def add_moisture_to_dust_df(path_moisture_grid_dust_days, dust_df):
+def add_moisture_to_dust_df(path_moisture_grid_dust_days, dust_df, window=None):
 
     print(f"Loading cached wldas data from {path_moisture_grid_dust_days}")
         #--- Seems to have some good default chunking scheme, 
         #--- gives me a warning when I try to implement my own
-    moisture_dust_days = xr.open_dataset(path_moisture_grid_dust_days)
+    moisture_dust_days = processed_store.open_for_query(
+        path_moisture_grid_dust_days, dust_df['datetime'], dust_df['latitude'], dust_df['longitude'], window=window
+    )
 
     print("Adding WLDAS moisture to dust dataframe...")
 
-    moisture_dates = pd.to_datetime(moisture_dust_days.time.values).normalize()
-    moisture_dates_set = set(moisture_dates.values)
-
-    dust_df['moisture'] = None
-    skipped_no_wldas_date = 0
-
-    for idx, row in dust_df.iterrows():
-        dust_time = row['datetime'].normalize()
-
-        if dust_time.to_datetime64() not in moisture_dates_set:
-            skipped_no_wldas_date += 1
-            continue
-
-        try:
-            wldas_point = moisture_dust_days.sel(
-                time=dust_time,
-                lat=row['latitude'],
-                lon=row['longitude'],
-                method="nearest"
-            )['SoilMoi00_10cm_tavg'].values.item()
-
-            dust_df.at[idx, 'moisture'] = wldas_point
-
-        except KeyError as e:
-            print(f"Skipping row {idx}: {e}")
+    #--- Matched on the calendar day, events on days missing from WLDAS are NaN and flagged
+    columns = point_sampler.sample_points(
+        moisture_dust_days, ['SoilMoi00_10cm_tavg'], dust_df['datetime'], dust_df['latitude'], dust_df['longitude'],
+        window=window
+    )
+    for name, values in columns.items():
+        if name.startswith('SoilMoi00_10cm_tavg'):
+            dust_df[name.replace('SoilMoi00_10cm_tavg', 'moisture')] = values
+    dust_df['moisture_missing_date'] = columns['missing_date']
 
     print(f"Total dust points: {len(dust_df)}")
-    print(f"Skipped (no matching WLDAS date): {skipped_no_wldas_date}")
+    print(f"Skipped (no matching WLDAS date): {columns['missing_date'].sum()}")
     print(f"Dust points tracked: {dust_df['moisture'].notna().sum()}")
 
     return dust_df
 
 
 def add_static_data(dust_df, location_name):
+    #--- Category codes keep the sampled dtype, so no-data pixels stay NaN (written as <NA> by write_table)
+
     #--- USAGE DATA
     cover_data_path = "DATA/processed/cec_land_cover/cec_land_cover_SW_epsg4326.tif"
     if os.path.exists(cover_data_path):
@@ -242,7 +257,7 @@ def add_static_data(dust_df, location_name):
         x=dust_lons,
         y=dust_lats,
         method="nearest"
-    ).values.squeeze().astype(int) 
+    ).values.squeeze()
 
     dust_df["usage"] = usage_vals
 
@@ -260,7 +275,7 @@ def add_static_data(dust_df, location_name):
         lon=dust_lons,
         lat=dust_lats,
         method="nearest"
-    ).values.squeeze().astype(int) 
+    ).values.squeeze()
     dust_df["texture"] = texture_vals
 
     #--- SOIL ORDERS DATA
@@ -275,7 +290,7 @@ def add_static_data(dust_df, location_name):
         lon=dust_lons,
         lat=dust_lats,
         method="nearest"
-    ).values.squeeze().astype(int) 
+    ).values.squeeze()
     dust_df["soil_order"] = soil_vals
 
     return dust_df
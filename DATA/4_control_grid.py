@@ -5,10 +5,15 @@ from datetime import datetime
 import xarray as xr
 import os
 import rioxarray as rxr
-import xesmf as xe  
+import regrid_weights
+import processed_store
 
 def main():
 
+    #--- "netcdf" or "zarr", chunked for how the grid is read (see processed_store.py)
+    output_format = "netcdf"
+    access = "balanced"
+
     #--- moisture data
     moisture_grid = xr.open_dataset("DATA/processed/1_moisture_grid_2026-06-29.nc")
 
@@ -20,8 +25,10 @@ def main():
 
     #--- save dataset
     timestamp = datetime.today().strftime("%Y-%m-%d")
-    processed_wldas_path = f"DATA/processed/4_control_grid_{timestamp}.nc"
-    moisture_grid.to_netcdf(processed_wldas_path)
+    processed_wldas_path = processed_store.get_output_path(
+        f"DATA/processed/4_control_grid_{timestamp}.nc", output_format
+    )
+    processed_store.write_dataset(moisture_grid, processed_wldas_path, output_format, access)
     print(f"Saved wldas set to {processed_wldas_path}")
 
     return
@@ -42,14 +49,18 @@ def merge_wind_era5_onto_moisture(moisture_grid, wind_grid):
             "longitude": ("longitude", wind_grid.longitude.values),
         }
     )
-    regridder = xe.Regridder(
+    #--- Only the source cells around the target region are read and regridded
+    window = regrid_weights.get_source_window(source_grid, target_grid)
+    source_grid = source_grid.isel(window)
+
+    regridder = regrid_weights.get_regridder(
         source_grid,
         target_grid,
         method="bilinear",
         periodic=False
     )
 
-    wind_regridded = regridder(wind_grid["wind_speed"])
+    wind_regridded = regridder(wind_grid["wind_speed"].isel(window))
     wind_regridded["time"] = wind_regridded.indexes["time"].normalize()
 
     merged_grid = xr.merge([
@@ -74,14 +85,18 @@ def merge_wind_narr_onto_moisture(moisture_grid, wind_grid):
             "lon": (["y", "x"], wind_grid.lon.values),
         }
     )
-    regridder = xe.Regridder(
+    #--- Only the source cells around the target region are read and regridded
+    window = regrid_weights.get_source_window(source_grid, target_grid)
+    source_grid = source_grid.isel(window)
+
+    regridder = regrid_weights.get_regridder(
         source_grid,
         target_grid,
         method="bilinear",
         periodic=False
     )
 
-    wind_regridded = regridder(wind_grid["wind_speed"])
+    wind_regridded = regridder(wind_grid["wind_speed"].isel(window))
     wind_regridded["time"] = wind_regridded.indexes["time"].normalize()
 
     moisture_grid = xr.merge([
@@ -5,9 +5,9 @@ from datetime import datetime
 import xarray as xr
 import os
 import rioxarray as rxr
-import xesmf as xe  
-import pandas as pd
+import regrid_weights
 import numpy as np
+import dust_events
 
 def main():
 
@@ -20,7 +20,7 @@ def main():
     moisture_grid = merge_orders_onto_moisture(moisture_grid)
 
     dust_path = "DATA/raw/line_dust/Line_GOES-Dust_Date-LatLon-UTC_2001-2020_Sep2025.csv"
-    dust_df = pd.read_csv(dust_path)
+    dust_df = dust_events.get_dust_df(dust_path, drop_invalid=False) #--- every site, also events without a valid start time
     grid_dust_sites = mask_to_dust_sites(moisture_grid, dust_df)
 
     #--- save dataset
@@ -47,14 +47,18 @@ def merge_wind_era5_onto_moisture(moisture_grid, wind_grid):
             "longitude": ("longitude", wind_grid.longitude.values),
         }
     )
-    regridder = xe.Regridder(
+    #--- Only the source cells around the target region are read and regridded
+    window = regrid_weights.get_source_window(source_grid, target_grid)
+    source_grid = source_grid.isel(window)
+
+    regridder = regrid_weights.get_regridder(
         source_grid,
         target_grid,
         method="bilinear",
         periodic=False
     )
 
-    wind_regridded = regridder(wind_grid["wind_speed"])
+    wind_regridded = regridder(wind_grid["wind_speed"].isel(window))
     wind_regridded["time"] = wind_regridded.indexes["time"].normalize()
 
     merged_grid = xr.merge([
@@ -1,22 +1,23 @@
 #--- Dataframe of dust events and the 30 days of moisture before and after
 #--- Add dask dataframe or run through xarray, currently doesn't have parallel (runs in 5 min)
 
-import xarray as xr
 import pandas as pd
 from datetime import datetime
 import time
 from pathlib import Path
+import processed_store
+import point_sampler
+import dust_events
 
 def main(): 
     start = time.time()
 
     dust_path = "DATA/raw/line_dust/Line_GOES-Dust_Date-LatLon-UTC_2001-2020_Sep2025.csv"
-    dust_df = get_dust_df(dust_path)
+    dust_df = dust_events.get_dust_df(dust_path) #--- dust_event_id is unique for each dust event
 
     #--- extend to 30 days before and after
     dfs = []
-    dust_df = dust_df.reset_index(drop=True) #--- unique IDs for each dust event
-    dust_df["dust_event_id"] = dust_df.index
+    dust_df = dust_df.reset_index(drop=True)
     for d in range(-30, 31):
         temp = dust_df.copy()
         temp["datetime"] = temp["datetime"] + pd.Timedelta(days=d)
@@ -27,11 +28,15 @@ def main():
 
     #--- moisture data
     processed_moisture_path = Path("DATA/processed/1_moisture_grid_2026-05-15.nc")
-    df_expanded = add_moisture_to_dust_df(processed_moisture_path, df_expanded)
+    n_threads = 8 #--- threads reading moisture chunks, None to read them in turn
+    df_expanded = add_moisture_to_dust_df(processed_moisture_path, df_expanded, n_threads)
 
     #--- save dataset
+    table_formats = ["parquet", "csv"]
     timestamp = datetime.today().strftime("%Y-%m-%d")
-    df_expanded.to_csv(f"DATA/processed/6_time_trend_{timestamp}.csv", index=False)
+    dtypes = processed_store.get_table_dtypes(df_expanded)
+    dtypes["dust_event_id"] = "int32"
+    processed_store.write_table(df_expanded, f"DATA/processed/6_time_trend_{timestamp}.parquet", table_formats, dtypes)
         
     end = time.time()
     print(f"Time to process: {end - start:.2f} seconds")
@@ -40,72 +45,27 @@ def main():
 
 #------------------------
 
-def get_dust_df(dust_path):
-    print("Opening dust data, creating dust dataframe... ")
-    dust_df = pd.read_csv(dust_path)
-
-    dust_df["time_str"] = (
-        dust_df["start_time_utc"]
-        .astype("Int64")        # allows NaNs safely
-        .astype(str)
-        .str.zfill(4)
-    )
-
-    dust_df["datetime"] = pd.to_datetime(
-        dust_df["date"].astype(str) + dust_df["time_str"],
-        format="%Y%m%d%H%M",
-        utc=True,
-        errors="coerce"
-    )
-
-    n_before = len(dust_df)
-    dust_df = dust_df.dropna(subset=["datetime"]).copy()
-    n_after = len(dust_df)
-    n_removed = n_before - n_after
-    print(f"Removed {n_removed} dust events due to invalid datetime parsing.")
-
-    dust_df["datetime"] = (
-        dust_df["datetime"]
-        .dt.tz_convert(None)
-    )
-    return dust_df
-
-def add_moisture_to_dust_df(path_moisture_grid_dust_days, dust_df):
+def add_moisture_to_dust_df(path_moisture_grid_dust_days, dust_df, n_threads=None):
 
     print(f"Loading cached wldas data from {path_moisture_grid_dust_days}")
 
-    moisture_dust_days = xr.open_dataset(path_moisture_grid_dust_days)
+    #--- Opens the layout copy reading the fewest chunks for these event pixels and days
+    moisture_dust_days = processed_store.open_for_query(
+        path_moisture_grid_dust_days, dust_df['datetime'], dust_df['latitude'], dust_df['longitude']
+    )
 
     print("Adding WLDAS moisture to dust dataframe...")
 
-    moisture_dates = pd.to_datetime(moisture_dust_days.time.values).normalize()
-    moisture_dates_set = set(moisture_dates.values)
-
-    dust_df['moisture'] = None
-    skipped_no_wldas_date = 0
-
-    for idx, row in dust_df.iterrows():
-        dust_time = row['datetime'].normalize()
-
-        if dust_time.to_datetime64() not in moisture_dates_set:
-            skipped_no_wldas_date += 1
-            continue
-
-        try:
-            wldas_point = moisture_dust_days.sel(
-                time=dust_time,
-                lat=row['latitude'],
-                lon=row['longitude'],
-                method="nearest"
-            )['SoilMoi00_10cm_tavg'].values.item()
-
-            dust_df.at[idx, 'moisture'] = wldas_point
-
-        except KeyError as e:
-            print(f"Skipping row {idx}: {e}")
+    #--- Points are read grouped by moisture chunk, each chunk once, then put back in row order
+    columns = point_sampler.sample_points(
+        moisture_dust_days, ['SoilMoi00_10cm_tavg'], dust_df['datetime'], dust_df['latitude'], dust_df['longitude'],
+        n_threads=n_threads
+    )
+    dust_df['moisture'] = columns['SoilMoi00_10cm_tavg']
+    dust_df['moisture_missing_date'] = columns['missing_date']
 
     print(f"Total dust points: {len(dust_df)}")
-    print(f"Skipped (no matching WLDAS date): {skipped_no_wldas_date}")
+    print(f"Skipped (no matching WLDAS date): {columns['missing_date'].sum()}")
     print(f"Dust points tracked: {dust_df['moisture'].notna().sum()}")
 
     return dust_df
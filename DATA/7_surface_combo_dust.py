@@ -10,14 +10,17 @@ import numpy as np
 import rioxarray as rxr
 from pyproj import CRS, Transformer
 import rasterio
-import pandas as pd
 from datetime import datetime
 import os
-import xesmf as xe  
+import regrid_weights
+import dust_events
+import event_clusters
 
 def main():
 
-    dust_df = pd.read_csv("DATA/processed/3_dust_points_vars_2026-07-13.csv")
+    dust_path = "DATA/raw/line_dust/Line_GOES-Dust_Date-LatLon-UTC_2001-2020_Sep2025.csv"
+    dust_df = dust_events.get_dust_df(dust_path) #--- same events as 3_dust_points_vars
+    dust_df = event_clusters.cluster_events(dust_df, distance_km=50, hours=3) #--- same clusters as 3_dust_points_vars
     wind_grid = xr.open_dataset("DATA/processed/2_wind_grid_narr_2026-06-15.nc")
 
     texture_da = get_texture_map()
@@ -213,6 +216,16 @@ def bin_dust_events_on_common_grid(combo_three_ds, dust_df):
     )
 
     combo_three_ds["dust_event_count"] = (("lat", "lon"), counts)
+
+    #--- Each cluster of events (event_clusters.py) counted once, at its representative event
+    if "is_cluster_representative" in dust_df:
+        representatives = dust_df[dust_df["is_cluster_representative"]]
+        cluster_counts, _, _ = np.histogram2d(
+            representatives["latitude"],
+            representatives["longitude"],
+            bins=[lat_edges, lon_edges]
+        )
+        combo_three_ds["dust_cluster_count"] = (("lat", "lon"), cluster_counts)
     
     return combo_three_ds
 
@@ -230,14 +243,18 @@ def merge_wind_narr_on_common_grid(combo_three_ds, wind_grid):
             "lon": (["y", "x"], wind_grid.lon.values),
         }
     )
-    regridder = xe.Regridder(
+    #--- Only the source cells around the target region are read and regridded
+    window = regrid_weights.get_source_window(source_grid, target_grid)
+    source_grid = source_grid.isel(window)
+
+    regridder = regrid_weights.get_regridder(
         source_grid,
         target_grid,
         method="bilinear",
         periodic=False
     )
 
-    wind_regridded = regridder(wind_grid["wind_speed"])
+    wind_regridded = regridder(wind_grid["wind_speed"].isel(window))
     wind_regridded["time"] = wind_regridded.indexes["time"].normalize()
 
     merged_grid = xr.merge([
@@ -0,0 +1,81 @@
+#--- Parsed dust events (Line 2025), shared by stages 3, 5, 6 and 7
+#------ The raw CSV is parsed once and cached as Parquet next to the file catalog,
+#------ it is parsed again only when the CSV changes (matched on size and mtime)
+#------ dust_event_id is the event's row in the raw CSV, the same in every stage's output
+
+import pandas as pd
+import numpy as np
+import json
+import os
+import file_catalog
+
+#------------------------
+
+def get_dust_df(dust_path, drop_invalid=True):
+    '''
+    Dust events with a datetime64 start time, float lat/lon and a stable dust_event_id.
+    Events whose start time can't be parsed are dropped, or kept with a NaT datetime if drop_invalid=False.
+    '''
+    print("Opening dust data, creating dust dataframe... ")
+    stat = os.stat(dust_path)
+    source = {"path": str(dust_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    if _read_cache_source(dust_path) == source:
+        dust_df = pd.read_parquet(_get_cache_path(dust_path))
+    else:
+        print(f"Parsing {dust_path}...")
+        dust_df = parse_dust_csv(dust_path)
+        _write_cache(dust_path, dust_df, source)
+
+    if drop_invalid:
+        invalid = dust_df["datetime"].isna()
+        dust_df = dust_df[~invalid].copy()
+        print(f"Removed {invalid.sum()} dust events due to invalid datetime parsing.")
+
+    return dust_df
+
+def parse_dust_csv(dust_path):
+    '''
+    Read the raw dust CSV and build each event's start datetime from its date and UTC start time.
+    '''
+    dust_df = pd.read_csv(dust_path)
+    dust_df["dust_event_id"] = np.arange(len(dust_df), dtype="int32")
+
+    dust_df["time_str"] = (
+        dust_df["start_time_utc"]
+        .astype("Int64")        # allows NaNs safely
+        .astype(str)
+        .str.zfill(4)
+    )
+
+    dust_df["datetime"] = pd.to_datetime(
+        dust_df["date"].astype(str) + dust_df["time_str"],
+        format="%Y%m%d%H%M",
+        utc=True,
+        errors="coerce"
+    ).dt.tz_convert(None)
+
+    dust_df["latitude"] = dust_df["latitude"].astype("float64")
+    dust_df["longitude"] = dust_df["longitude"].astype("float64")
+
+    return dust_df
+
+#------------------------
+
+def _get_cache_path(dust_path):
+    name = os.path.splitext(os.path.basename(dust_path))[0]
+    return f"{file_catalog.CATALOG_DIR}/dust_events_{name}.parquet"
+
+def _read_cache_source(dust_path):
+    source_path = f"{os.path.splitext(_get_cache_path(dust_path))[0]}.json"
+    if not os.path.exists(source_path) or not os.path.exists(_get_cache_path(dust_path)):
+        return None
+    with open(source_path) as f:
+        return json.load(f)
+
+def _write_cache(dust_path, dust_df, source):
+    os.makedirs(file_catalog.CATALOG_DIR, exist_ok=True)
+    dust_df.to_parquet(_get_cache_path(dust_path), index=False)
+    with open(f"{os.path.splitext(_get_cache_path(dust_path))[0]}.json", "w") as f:
+        json.dump(source, f)
+    return
@@ -0,0 +1,95 @@
+#--- Space-time clusters of dust events
+#------ Events within distance_km (great-circle) and hours of each other are linked, clusters are the
+#------ connected groups of links (single linkage), so one plume reported several times counts once
+#------ Links are found per time bucket of width hours with a KD-tree over that bucket and the next,
+#------ never by comparing every pair of events
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import spatial_index
+
+#------------------------
+
+def cluster_events(dust_df, distance_km=50, hours=3):
+    '''
+    Add cluster_id, cluster_size and the cluster's representative event (the member nearest the
+    cluster's mean position) as cluster_latitude/longitude/datetime and is_cluster_representative.
+    Events without a valid datetime are clusters of their own.
+    '''
+    if hours <= 0:
+        raise ValueError(f"Cluster time tolerance must be positive: {hours}")
+
+    print(f"Clustering dust events within {distance_km} km and {hours} h...")
+    lats = dust_df["latitude"].to_numpy(dtype="float64")
+    lons = dust_df["longitude"].to_numpy(dtype="float64")
+    times = dust_df["datetime"].to_numpy(dtype="datetime64[ns]")
+
+    points = spatial_index.to_unit_sphere(lats, lons)
+    pairs = get_linked_pairs(points, times, spatial_index.get_chord(distance_km), hours)
+
+    n_events = len(dust_df)
+    links = coo_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(n_events, n_events))
+    _, cluster_id = connected_components(links, directed=False)
+
+    representative = get_representatives(points, cluster_id)
+    cluster_size = np.bincount(cluster_id)
+
+    dust_df = dust_df.copy()
+    dust_df["cluster_id"] = cluster_id.astype("int32")
+    dust_df["cluster_size"] = cluster_size[cluster_id].astype("int32")
+    dust_df["cluster_latitude"] = lats[representative][cluster_id]
+    dust_df["cluster_longitude"] = lons[representative][cluster_id]
+    dust_df["cluster_datetime"] = times[representative][cluster_id]
+    dust_df["is_cluster_representative"] = np.arange(n_events) == representative[cluster_id]
+
+    print(f"{n_events} dust events in {len(cluster_size)} clusters.")
+    return dust_df
+
+def get_linked_pairs(points, times, chord, hours):
+    '''
+    Positions (i, j) of every pair of events within chord on the unit sphere and hours in time.
+    '''
+    valid = ~np.isnat(times)
+    if not valid.any():
+        return np.empty((0, 2), dtype="int64")
+
+    hours_since = np.full(len(times), np.nan)
+    hours_since[valid] = (times[valid] - times[valid].min()) / np.timedelta64(1, "h")
+
+    #--- Linked events are in the same or neighbouring buckets, each bucket is searched with the next one
+    bucket = np.full(len(times), -1, dtype="int64")
+    bucket[valid] = np.floor(hours_since[valid] / hours).astype("int64")
+    order = np.flatnonzero(valid)[np.argsort(bucket[valid], kind="stable")]
+    buckets, starts = np.unique(bucket[order], return_index=True)
+    ends = np.r_[starts[1:], len(order)]
+
+    pairs = [np.empty((0, 2), dtype="int64")]
+    for i, (b, start, end) in enumerate(zip(buckets, starts, ends)):
+        if i + 1 < len(buckets) and buckets[i + 1] == b + 1:
+            end = ends[i + 1]
+        members = order[start:end]
+
+        found = cKDTree(points[members]).query_pairs(chord, output_type="ndarray")
+        found = members[found]
+        close_in_time = np.abs(hours_since[found[:, 0]] - hours_since[found[:, 1]]) <= hours
+        pairs.append(found[close_in_time])
+
+    return np.concatenate(pairs)
+
+def get_representatives(points, cluster_id):
+    '''
+    Position of the member of each cluster nearest the cluster's mean position on the sphere.
+    '''
+    if len(cluster_id) == 0:
+        return np.empty(0, dtype="int64")
+
+    centres = np.zeros((cluster_id.max() + 1, 3))
+    np.add.at(centres, cluster_id, points)
+
+    #--- Largest dot product with the (unnormalised) mean direction is the nearest member
+    closeness = np.einsum("ij,ij->i", points, centres[cluster_id])
+    order = np.lexsort((-closeness, cluster_id))
+    first = np.r_[True, cluster_id[order][1:] != cluster_id[order][:-1]]
+    return order[first]
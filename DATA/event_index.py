@@ -0,0 +1,202 @@
+#--- Index over the dust events for region, date, radius and polygon queries
+#------ Events are bucketed on a lat/lon grid (sorted by cell, so a box is one searchsorted per row of cells)
+#------ and sorted by time; a query starts from whichever of the two gives fewer candidates
+#------ Radius queries use a KD-tree over the events on the unit sphere, built with the index
+
+import pandas as pd
+import numpy as np
+from scipy.spatial import cKDTree
+import spatial_index
+
+LOCATIONS = {
+    "American Southwest": [(43, -124), (25, -97)],
+    
+    "Chihuahua": [(33.3, -110.0), (28.0, -105.3)],
+    "West Texas": [(35.0, -104.0), (31.8, -100.5)],
+    "Central High Plains": [(43.0, -105.0), (36.5, -98.0)],
+    "Nevada": [(43.0, -120.7), (37.0, -114.5)],
+    "Utah": [(42.0, -114.5), (37.5, -109.0)],
+    "Southern California": [(37.0, -119.0), (30.0, -114.2)],
+    "Four Corners": [(37.5, -112.5), (34.4, -107.0)],
+    "San Luis Valley": [(38.5, -106.5), (37.0, -105.3)],
+
+    "N Mexico 1": [(31.8, -107.6), (31.3, -107.1)],
+    "Carson Sink": [(40.1, -118.75), (39.6, -118.25)],
+    "N Mexico 2": [(31.4, -108.25), (30.9, -107.75)],
+    "N Mexico 3": [(31.1, -107.15), (30.6, -106.65)],
+    "Black Rock 1": [(41.15, -119.35), (40.65, -118.85)],
+    "West Texas 1": [(32.95, -102.35), (32.45, -101.85)],
+    "N Mexico 4": [(30.65, -107.65), (30.15, -107.15)],
+    "N Mexico 5": [(31.0, -106.65), (30.5, -106.15)],
+    "White Sands": [(33.15, -106.6), (32.65, -106.1)],
+    "West Texas 2": [(33.5, -102.8), (33.0, -102.30)],
+    "SLV2": [(38.05, -106.15), (37.55, -105.65)],
+    "N Mexico 6": [(29.55, -107.05), (29.05, -106.55)],
+    "NE AZ": [(35.7, -111.1), (35.2, -110.6)],
+    "NW New Mexico": [(36.15, -108.85), (35.65, -108.35)],
+    "Black Rock 2": [(40.75, -119.9), (40.25, -119.4)],
+    "N Mexico 7": [(30.9, -108.15), (30.4, -107.65)],
+}
+
+#------------------------
+
+def build_event_index(dust_df, cell_deg=0.5):
+    '''
+    Index over the events of dust_df (from dust_events.get_dust_df), queried with the query_* functions.
+    '''
+    lats = dust_df["latitude"].to_numpy(dtype="float64")
+    lons = dust_df["longitude"].to_numpy(dtype="float64")
+    times = dust_df["datetime"].to_numpy(dtype="datetime64[ns]")
+
+    lat_origin = np.floor(lats.min()) if len(lats) else 0.0
+    lon_origin = np.floor(lons.min()) if len(lons) else 0.0
+    n_cols = int((lons.max() - lon_origin) // cell_deg) + 1 if len(lons) else 1
+    cells = _get_cell_keys(lats, lons, lat_origin, lon_origin, cell_deg, n_cols)
+
+    cell_order = np.argsort(cells, kind="stable")
+    #--- Events without a valid datetime are left out of the time order, no date range can hold them
+    valid = np.flatnonzero(~np.isnat(times))
+    time_order = valid[np.argsort(times[valid], kind="stable")]
+
+    index = {
+        "events": dust_df,
+        "lats": lats,
+        "lons": lons,
+        "times": times,
+        "cell_deg": cell_deg,
+        "lat_origin": lat_origin,
+        "lon_origin": lon_origin,
+        "n_cols": n_cols,
+        "cell_order": cell_order,
+        "sorted_cells": cells[cell_order],
+        "time_order": time_order,
+        "sorted_times": times[time_order],
+        "tree": cKDTree(spatial_index.to_unit_sphere(lats, lons)),
+    }
+    return index
+
+def query_box(index, lat_min, lat_max, lon_min, lon_max, start_date=None, end_date=None):
+    '''
+    Events inside the lat/lon box (edges included) between the dates.
+    Both dates are inclusive (an end date at midnight keeps that whole day), None leaves the range open.
+    '''
+    positions = _get_box_positions(index, lat_min, lat_max, lon_min, lon_max, start_date, end_date)
+    return _get_events(index, positions)
+
+def query_region(index, location_name, start_date=None, end_date=None):
+    '''
+    Events inside one of the Line 2025 regions or hotspot boxes between the dates.
+    '''
+    lat_min, lat_max, lon_min, lon_max = _get_coords_for_region(location_name)
+    return query_box(index, lat_min, lat_max, lon_min, lon_max, start_date, end_date)
+
+def query_regions(index, location_names=None, start_date=None, end_date=None):
+    '''
+    Events of every region (all Line 2025 regions and hotspot boxes by default), by region name.
+    '''
+    if location_names is None:
+        location_names = list(LOCATIONS)
+    return {name: query_region(index, name, start_date, end_date) for name in location_names}
+
+def query_radius(index, lat, lon, radius_km, start_date=None, end_date=None):
+    '''
+    Events within radius_km (great-circle) of (lat, lon) between the dates.
+    '''
+    point = spatial_index.to_unit_sphere(lat, lon)[0]
+    positions = np.array(index["tree"].query_ball_point(point, spatial_index.get_chord(radius_km)), dtype="int64")
+    positions = _filter_time(index, positions, start_date, end_date)
+    return _get_events(index, positions)
+
+def query_polygon(index, polygon, start_date=None, end_date=None):
+    '''
+    Events inside a polygon given as (lat, lon) vertices, like the region corners, between the dates.
+    '''
+    polygon = np.asarray(polygon, dtype="float64")
+    lat_min, lon_min = polygon.min(axis=0)
+    lat_max, lon_max = polygon.max(axis=0)
+
+    positions = _get_box_positions(index, lat_min, lat_max, lon_min, lon_max, start_date, end_date)
+    inside = _contains_points(polygon, index["lats"][positions], index["lons"][positions])
+    return _get_events(index, positions[inside])
+
+#------------------------
+
+def _get_cell_keys(lats, lons, lat_origin, lon_origin, cell_deg, n_cols):
+    rows = np.floor((lats - lat_origin) / cell_deg).astype("int64")
+    cols = np.clip(np.floor((lons - lon_origin) / cell_deg).astype("int64"), 0, n_cols - 1)
+    return rows * n_cols + cols
+
+def _get_box_positions(index, lat_min, lat_max, lon_min, lon_max, start_date, end_date):
+    cell_deg = index["cell_deg"]
+    n_cols = index["n_cols"]
+    row_min = int(np.floor((lat_min - index["lat_origin"]) / cell_deg))
+    row_max = int(np.floor((lat_max - index["lat_origin"]) / cell_deg))
+    col_min = int(np.clip(np.floor((lon_min - index["lon_origin"]) / cell_deg), 0, n_cols - 1))
+    col_max = int(np.clip(np.floor((lon_max - index["lon_origin"]) / cell_deg), 0, n_cols - 1))
+
+    #--- Each row of cells inside the box is one run of sorted cell keys
+    rows = np.arange(row_min, row_max + 1)
+    starts = np.searchsorted(index["sorted_cells"], rows * n_cols + col_min, side="left")
+    ends = np.searchsorted(index["sorted_cells"], rows * n_cols + col_max, side="right")
+
+    time_start, time_end = _get_time_range(index, start_date, end_date)
+    no_dates = start_date is None and end_date is None
+    if no_dates or (ends - starts).sum() <= time_end - time_start:
+        runs = [index["cell_order"][s:e] for s, e in zip(starts, ends)]
+        positions = np.concatenate([np.array([], dtype="int64")] + runs)
+        positions = _filter_time(index, positions, start_date, end_date)
+    else:
+        positions = index["time_order"][time_start:time_end]
+
+    lats = index["lats"][positions]
+    lons = index["lons"][positions]
+    inside = (lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)
+    return positions[inside]
+
+def _get_time_range(index, start_date, end_date):
+    sorted_times = index["sorted_times"]
+    time_start = 0 if start_date is None else np.searchsorted(sorted_times, np.datetime64(pd.Timestamp(start_date), "ns"), side="left")
+    time_end = len(sorted_times) if end_date is None else np.searchsorted(sorted_times, _get_end_time(end_date), side="right")
+    return time_start, time_end
+
+def _get_end_time(end_date):
+    #--- An end date at midnight includes the whole day
+    end = pd.Timestamp(end_date)
+    if end == end.normalize():
+        end = end + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    return np.datetime64(end, "ns")
+
+def _filter_time(index, positions, start_date, end_date):
+    times = index["times"][positions]
+    keep = np.ones(len(positions), dtype=bool)
+    if start_date is not None:
+        keep &= times >= np.datetime64(pd.Timestamp(start_date), "ns")
+    if end_date is not None:
+        keep &= times <= _get_end_time(end_date)
+    return positions[keep]
+
+def _contains_points(polygon, lats, lons):
+    #--- Even-odd rule: count the polygon edges crossed by a ray from each point towards +lon
+    inside = np.zeros(len(lats), dtype=bool)
+    for (lat_a, lon_a), (lat_b, lon_b) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        spans = (lat_a > lats) != (lat_b > lats)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lon_cross = lon_a + (lats - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+        inside ^= spans & (lons < lon_cross)
+    return inside
+
+def _get_events(index, positions):
+    return index["events"].iloc[np.sort(positions)]
+
+def _get_coords_for_region(location_name):
+    """
+    Get the lat and lon range from the dictionary of regions used in Line 2025. 
+    """
+    coords = LOCATIONS[location_name]
+    lats = [p[0] for p in coords]
+    lons = [p[1] for p in coords]
+
+    lat_min, lat_max = min(lats), max(lats)
+    lon_min, lon_max = min(lons), max(lons)
+
+    return lat_min, lat_max, lon_min, lon_max
@@ -0,0 +1,212 @@
+#--- Cached catalog of the raw WLDAS, NARR and ERA5 input files
+#------ Headers are only read for new or changed files (matched on size and mtime)
+#------ Stages query by date range for an ordered file list with the time and grid already known,
+#------ and open_catalog_dataset builds the lazy dataset from the catalog instead of every file's header
+
+import xarray as xr
+import pandas as pd
+import numpy as np
+import dask
+import dask.array
+import glob
+import json
+import os
+
+CATALOG_DIR = "DATA/processed/catalog"
+
+SOURCES = {
+    "wldas": {
+        "pattern": "/mnt/data2/jturner/wldas_data/WLDAS_NOAHMP001_DA1_*.nc.SUB.nc4",
+        "time_dim": "time",
+    },
+    "narr_uwnd": {
+        "pattern": "/mnt/data2/jturner/narr/uwnd.10m.20*.nc",
+        "time_dim": "time",
+    },
+    "narr_vwnd": {
+        "pattern": "/mnt/data2/jturner/narr/vwnd.10m.20*.nc",
+        "time_dim": "time",
+    },
+    "era5": {
+        "pattern": "/mnt/data2/jturner/era5/era5_wind*.nc",
+        "time_dim": "valid_time",
+    },
+    "era5_land": {
+        "pattern": "/mnt/data2/jturner/era5_land/era5_land_wind*.nc",
+        "time_dim": "valid_time",
+    },
+    "era5_gust": {
+        "pattern": "/mnt/data2/jturner/era5/era5_gust*.nc",
+        "time_dim": "valid_time",
+    },
+}
+
+#------------------------
+
+def update_catalog(source):
+    '''
+    Load the cached catalog for a source, re-reading headers only for files that are new or changed.
+    '''
+    pattern = SOURCES[source]["pattern"]
+    time_dim = SOURCES[source]["time_dim"]
+
+    catalog = _read_catalog(source)
+    cached = {entry["path"]: entry for entry in catalog["files"]}
+
+    entries = []
+    grid = None
+    has_grid = os.path.exists(_get_grid_path(source))
+    n_read = 0
+    for path in sorted(glob.glob(pattern)):
+        stat = os.stat(path)
+        entry = cached.get(path)
+
+        #--- The grid is saved with the first entry read, so a catalog without one re-reads a header for it
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime or not has_grid:
+            entry, file_grid = _read_file_header(path, time_dim)
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+            if grid is None:
+                grid = file_grid
+                has_grid = True
+            n_read += 1
+
+        entries.append(entry)
+
+    entries = sorted(entries, key=lambda e: e["start"])
+    n_removed = len(set(cached) - {e["path"] for e in entries})
+
+    if n_read or n_removed or not os.path.exists(_get_catalog_path(source)):
+        print(f"Catalog {source}: read {n_read} headers, dropped {n_removed} missing files.")
+        catalog = {"source": source, "pattern": pattern, "time_dim": time_dim, "files": entries}
+        _write_catalog(source, catalog, grid)
+
+    return catalog
+
+def query_files(source, start_date=None, end_date=None):
+    '''
+    Catalog entries (ordered by time) for files overlapping the date range, inclusive.
+    '''
+    catalog = update_catalog(source)
+
+    start = pd.Timestamp(start_date) if start_date is not None else pd.Timestamp.min
+    end = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.max
+
+    selected = [
+        entry for entry in catalog["files"]
+        if pd.Timestamp(entry["end"]) >= start and pd.Timestamp(entry["start"]) <= end
+    ]
+    return selected
+
+def get_catalog_times(entries):
+    '''
+    Time coordinate for a list of catalog entries, without opening the files.
+    '''
+    times = []
+    for entry in entries:
+        if "times" in entry:
+            times.append(pd.DatetimeIndex(entry["times"]))
+        else:
+            times.append(pd.date_range(entry["start"], entry["end"], periods=entry["n_time"]))
+    return pd.DatetimeIndex(np.concatenate(times))
+
+def get_catalog_grid(source):
+    '''
+    Spatial coordinates shared by every file of a source, as stored when the catalog was built.
+    '''
+    with np.load(_get_grid_path(source)) as grid:
+        return {name: grid[name] for name in grid.files}
+
+def open_catalog_dataset(source, entries, chunks="auto", drop_variables=None, preprocess=None):
+    '''
+    Open catalog entries as one lazy dataset, reading only the first file's header.
+    Times and the grid come from the catalog, variables from the first file (all files share them),
+    and each file is only opened (and preprocessed) when its data is computed.
+    '''
+    time_dim = SOURCES[source]["time_dim"]
+    grid = get_catalog_grid(source)
+
+    with xr.open_dataset(entries[0]["path"], drop_variables=drop_variables) as first:
+        template = first.isel({time_dim: slice(0, 1)})
+        if preprocess is not None:
+            template = preprocess(template)
+        template = template.load()
+
+    #--- Grid coordinates from the catalog, unless preprocess cut the grid (then the template's match it)
+    coords = {}
+    for name, coord in template.coords.items():
+        if time_dim in coord.dims:
+            continue
+        coords[name] = (coord.dims, grid[name]) if name in grid and grid[name].shape == coord.shape else coord
+    coords[time_dim] = get_catalog_times(entries)
+
+    data_vars = {}
+    for name, template_da in template.data_vars.items():
+        if time_dim not in template_da.dims:
+            data_vars[name] = template_da
+            continue
+
+        axis = template_da.dims.index(time_dim)
+        blocks = []
+        for entry in entries:
+            shape = list(template_da.shape)
+            shape[axis] = entry["n_time"]
+            values = dask.delayed(_read_file_variable)(entry["path"], name, drop_variables, preprocess)
+            blocks.append(dask.array.from_delayed(values, shape=tuple(shape), dtype=template_da.dtype))
+        data_vars[name] = xr.Variable(template_da.dims, dask.array.concatenate(blocks, axis=axis),
+                                      attrs=template_da.attrs, encoding=template_da.encoding)
+
+    ds = xr.Dataset(data_vars, coords=coords, attrs=template.attrs)
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    return ds
+
+#------------------------
+
+def _read_file_variable(path, name, drop_variables, preprocess):
+    with xr.open_dataset(path, drop_variables=drop_variables) as ds:
+        if preprocess is not None:
+            ds = preprocess(ds)
+        return ds[name].values
+
+def _read_file_header(path, time_dim):
+    with xr.open_dataset(path) as ds:
+        times = pd.DatetimeIndex(ds[time_dim].values)
+        entry = {
+            "path": path,
+            "start": times[0].isoformat(),
+            "end": times[-1].isoformat(),
+            "n_time": len(times),
+            "dims": {dim: int(size) for dim, size in ds.sizes.items()},
+            "variables": list(ds.data_vars),
+        }
+        regular = pd.date_range(times[0], times[-1], periods=len(times))
+        if len(times) > 1 and not times.equals(regular):
+            entry["times"] = [t.isoformat() for t in times]
+
+        grid = {
+            name: coord.values for name, coord in ds.coords.items()
+            if time_dim not in coord.dims
+        }
+    return entry, grid
+
+def _get_catalog_path(source):
+    return f"{CATALOG_DIR}/{source}.json"
+
+def _get_grid_path(source):
+    return f"{CATALOG_DIR}/{source}_grid.npz"
+
+def _read_catalog(source):
+    catalog_path = _get_catalog_path(source)
+    if not os.path.exists(catalog_path):
+        return {"files": []}
+    with open(catalog_path) as f:
+        return json.load(f)
+
+def _write_catalog(source, catalog, grid):
+    os.makedirs(CATALOG_DIR, exist_ok=True)
+    with open(_get_catalog_path(source), "w") as f:
+        json.dump(catalog, f)
+    if grid is not None:
+        np.savez(_get_grid_path(source), **grid)
+    return
@@ -0,0 +1,176 @@
+#--- Sampling processed grids at batches of (time, lat, lon) points
+#------ All grid indices are resolved at once (dates by lookup, pixels by nearest neighbour),
+#------ then each variable is read chunk by chunk: points are grouped by the storage chunk holding them,
+#------ every chunk is read once (optionally in threads) and the values are put back in point order
+#------ Points whose date is not in the grid come back as NaN with a missing-date flag
+#------ Optionally max, mean, min and valid count over the k x k pixels around each point, read in the same pass
+
+import xarray as xr
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import spatial_index
+
+#------------------------
+
+def sample_points(ds, variables, times, lats, lons, match="date", time_dim="time", n_threads=None, window=None):
+    '''
+    Values of each variable at the nearest pixel to every (lat, lon) on its date (match="date")
+    or exact time (match="exact"), as float64 columns, plus a boolean missing_date column.
+    With window=k, also {name}_max/mean/min/count_{k}x{k} over the k x k pixels centred on each point.
+    '''
+    indexers, missing_date, inside = get_point_indexers(ds, times, lats, lons, match, time_dim, window)
+
+    columns = {}
+    for name in variables:
+        values = read_points(ds[name], indexers, n_threads).astype("float64")
+        if window is None:
+            columns[name] = np.where(missing_date, np.nan, values)
+            continue
+
+        values = np.where(inside, values.reshape(inside.shape), np.nan)
+        columns[name] = values[:, inside.shape[1] // 2]
+        columns.update(get_window_statistics(values, name, window))
+    columns["missing_date"] = missing_date
+
+    return columns
+
+def get_point_indexers(ds, times, lats, lons, match="date", time_dim="time", window=None):
+    '''
+    Integer indexers by dimension for every point (every window pixel with window=k), as read by read_points,
+    whether each point's date is missing (read at index 0), and with a window which pixels are inside the grid.
+    '''
+    time_index, missing_date = get_time_index(ds, times, match, time_dim)
+    space_index = get_space_index(ds, lats, lons)
+    time_index = np.where(missing_date, 0, time_index)
+
+    if window is None:
+        indexers = {time_dim: time_index}
+        indexers.update(space_index)
+        return indexers, missing_date, None
+
+    indexers, inside = get_window_index(ds, time_dim, time_index, space_index, window)
+    inside &= ~missing_date[:, None]
+    return indexers, missing_date, inside
+
+def get_window_index(ds, time_dim, time_index, space_index, window):
+    '''
+    Flat indexers for the k x k pixels around every point (k = window, odd), point by point
+    with the centre pixel in the middle, and which of them fall inside the grid.
+    '''
+    if window % 2 == 0:
+        raise ValueError(f"Window must be an odd number of pixels: {window}")
+
+    half = window // 2
+    (row_dim, rows), (col_dim, cols) = space_index.items()
+    row_offsets, col_offsets = np.meshgrid(np.arange(-half, half + 1), np.arange(-half, half + 1), indexing="ij")
+
+    rows = rows[:, None] + row_offsets.ravel()[None, :]
+    cols = cols[:, None] + col_offsets.ravel()[None, :]
+    inside = (rows >= 0) & (rows < ds.sizes[row_dim]) & (cols >= 0) & (cols < ds.sizes[col_dim])
+
+    indexers = {
+        time_dim: np.repeat(time_index, window * window),
+        row_dim: np.clip(rows, 0, ds.sizes[row_dim] - 1).ravel(),
+        col_dim: np.clip(cols, 0, ds.sizes[col_dim] - 1).ravel(),
+    }
+    return indexers, inside
+
+def get_window_statistics(values, name, window):
+    '''
+    Max, mean, min and count of the valid values in each row of values (points by window pixels).
+    '''
+    valid = np.isfinite(values)
+    count = valid.sum(axis=1)
+    has_values = count > 0
+    suffix = f"{window}x{window}"
+
+    return {
+        f"{name}_max_{suffix}": np.where(has_values, np.where(valid, values, -np.inf).max(axis=1), np.nan),
+        f"{name}_mean_{suffix}": np.where(has_values, np.where(valid, values, 0).sum(axis=1) / np.maximum(count, 1), np.nan),
+        f"{name}_min_{suffix}": np.where(has_values, np.where(valid, values, np.inf).min(axis=1), np.nan),
+        f"{name}_count_{suffix}": count,
+    }
+
+def read_points(da, indexers, n_threads=None):
+    '''
+    Values of da at integer index arrays by dimension, one entry per point.
+    Chunked files are read one storage chunk at a time, each chunk once however many points it holds.
+    '''
+    chunks = da.encoding.get("chunks") or da.encoding.get("chunksizes")
+    if chunks is None or da.chunks is not None or set(indexers) != set(da.dims):
+        #--- Contiguous files and dask arrays take the points in a single pointwise read
+        return da.isel({dim: xr.DataArray(index, dims="point") for dim, index in indexers.items()}).values
+
+    index = np.stack([np.asarray(indexers[dim]) for dim in da.dims])
+    if index.shape[1] == 0:
+        return np.empty(0, dtype=da.dtype)
+    chunk_shape = np.array(chunks)[:, None]
+    chunk_index, groups = group_by_chunk(index, chunks)
+
+    def read_chunk(points):
+        origin = chunk_index[:, points[0]] * chunk_shape[:, 0]
+        block = da.isel({
+            dim: slice(start, start + size) for dim, start, size in zip(da.dims, origin, chunks)
+        }).values
+        return block[tuple(index[:, points] - origin[:, None])]
+
+    if n_threads:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            blocks = list(executor.map(read_chunk, groups))
+    else:
+        blocks = [read_chunk(points) for points in groups]
+
+    values = np.empty(index.shape[1], dtype=da.dtype)
+    for points, block in zip(groups, blocks):
+        values[points] = block
+    return values
+
+def group_by_chunk(index, chunks):
+    '''
+    Storage chunk of every point (index is dimensions by points) and the points of each distinct chunk,
+    one group per chunk read.
+    '''
+    chunk_index = index // np.array(chunks)[:, None]
+
+    #--- Points sorted by chunk, each run of equal chunk indices is one read
+    order = np.lexsort(chunk_index[::-1])
+    sorted_chunks = chunk_index[:, order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(sorted_chunks, axis=1) != 0).any(axis=0)])
+    return chunk_index, np.split(order, starts[1:])
+
+def get_time_index(ds, times, match="date", time_dim="time"):
+    '''
+    Position of every time in ds, and where it has none.
+    match="date" pairs times with the grid step on the same calendar day.
+    '''
+    grid_times = ds.indexes[time_dim]
+    times = pd.DatetimeIndex(times)
+    if match == "date":
+        grid_times = grid_times.normalize()
+        times = times.normalize()
+    elif match != "exact":
+        raise ValueError(f"Unknown time match: {match}")
+
+    time_index = grid_times.get_indexer(times)
+    return time_index, time_index < 0
+
+def get_space_index(ds, lats, lons):
+    '''
+    Indices of the grid point nearest every (lat, lon), by dimension name.
+    Curvilinear grids (2D lat/lon) are matched with spatial_index, regular grids per axis.
+    '''
+    lats = np.asarray(lats, dtype="float64")
+    lons = np.asarray(lons, dtype="float64")
+
+    if "lat" in ds.coords and ds["lat"].ndim == 2:
+        iy, ix = spatial_index.query_nearest(ds["lat"].values, ds["lon"].values, lats, lons)[:2]
+        return dict(zip(ds["lat"].dims, (iy, ix)))
+
+    for lat_name, lon_name in [("lat", "lon"), ("latitude", "longitude")]:
+        if lat_name in ds.indexes and lon_name in ds.indexes:
+            return {
+                lat_name: ds.indexes[lat_name].get_indexer(lats, method="nearest"),
+                lon_name: ds.indexes[lon_name].get_indexer(lons, method="nearest"),
+            }
+    raise ValueError("No lat/lon coordinates found to sample points on")
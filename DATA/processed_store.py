@@ -0,0 +1,243 @@
+#--- Writing processed grids as NetCDF files or chunked, compressed Zarr stores
+#------ Chunks are chosen from how the product will be read:
+#------ "map" full maps for a few days, "time_series" the whole record on small tiles,
+#------ "balanced" 100 days on medium tiles
+#------ A grid can also keep "map" and "time_series" copies, open_for_query opens the one reading the fewest
+#------ storage chunks for a batch of points
+#------ Dataframe outputs (stages 3 and 6) are written as Parquet with explicit dtypes, and optionally CSV
+
+import xarray as xr
+import pandas as pd
+import numpy as np
+import os
+import shutil
+import point_sampler
+
+TARGET_CHUNK_MB = 16
+LAYOUTS = ("map", "time_series")
+TABLE_FORMATS = ("parquet", "csv")
+
+#------------------------
+
+def get_chunks(ds, access="balanced", time_dim="time", target_chunk_mb=None):
+    '''
+    Chunk size for every dimension of ds, about target_chunk_mb per chunk of its largest variable.
+    '''
+    if target_chunk_mb is None:
+        target_chunk_mb = TARGET_CHUNK_MB
+    spatial_dims = [dim for dim in ds.dims if dim != time_dim]
+    itemsize = max(ds[name].dtype.itemsize for name in ds.data_vars)
+    target = target_chunk_mb * 1e6 / itemsize
+
+    n_time = ds.sizes[time_dim]
+    n_space = np.prod([ds.sizes[dim] for dim in spatial_dims])
+
+    if access == "map":
+        time_chunk = int(np.clip(target // n_space, 1, n_time))
+        chunks = {dim: ds.sizes[dim] for dim in spatial_dims}
+    elif access == "time_series":
+        time_chunk = n_time
+        tile = max(1, int((target / time_chunk) ** (1 / len(spatial_dims))))
+        chunks = {dim: min(ds.sizes[dim], tile) for dim in spatial_dims}
+    elif access == "balanced":
+        time_chunk = min(n_time, 100)
+        tile = max(1, int((target / time_chunk) ** (1 / len(spatial_dims))))
+        chunks = {dim: min(ds.sizes[dim], tile) for dim in spatial_dims}
+    else:
+        raise ValueError(f"Unknown access pattern: {access}")
+
+    chunks[time_dim] = time_chunk
+    return chunks
+
+def write_dataset(ds, path, output_format="netcdf", access="balanced", chunks=None, time_dim="time",
+                  group=None, mode="w", unlimited_dims=None, compute=True):
+    '''
+    Write ds compressed, with chunks from the access pattern (or the given chunks).
+    Time chunks are kept whole for zarr and unlimited NetCDF dimensions, so later appends fill them.
+    '''
+    if chunks is None:
+        chunks = get_chunks(ds, access, time_dim)
+    unlimited_dims = list(unlimited_dims or [])
+    growable = [time_dim] if output_format == "zarr" else unlimited_dims
+
+    def get_variable_chunks(da):
+        return tuple(
+            chunks[dim] if dim in growable else min(chunks.get(dim, da.sizes[dim]), da.sizes[dim])
+            for dim in da.dims
+        )
+
+    #--- Dask data is rechunked to the file chunks, in-memory data is split by the writer
+    if any(variable.chunks is not None for variable in ds.variables.values()):
+        ds = ds.chunk({dim: size for dim, size in chunks.items() if dim in ds.dims})
+
+    if not compute:
+        #--- Only the time-varying data is deferred (e.g. left for workers to fill in with write_region)
+        ds = ds.copy()
+        for name in ds.variables:
+            if time_dim not in ds[name].dims:
+                ds[name].load()
+
+    if output_format == "zarr":
+        #--- Encodings from the source NetCDF files (chunksizes, zlib, ...) don't apply to zarr
+        for name in ds.variables:
+            ds[name].encoding = {}
+        encoding = {name: {"chunks": get_variable_chunks(ds[name])} for name in ds.data_vars}
+        return ds.to_zarr(path, group=group, mode=mode, encoding=encoding, compute=compute)
+    elif output_format == "netcdf":
+        encoding = {
+            name: {"zlib": True, "complevel": 4, "chunksizes": get_variable_chunks(ds[name])}
+            for name in ds.data_vars
+        }
+        return ds.to_netcdf(path, group=group, mode=mode, encoding=encoding,
+                            unlimited_dims=unlimited_dims, compute=compute)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+def write_region(ds, path, region_start, time_dim="time", group=None):
+    '''
+    Write ds into the times of an existing zarr store starting at index region_start.
+    Used by worker processes; regions must line up with the store's time chunks.
+    '''
+    static = [name for name in ds.variables if time_dim not in ds[name].dims]
+    #--- Loaded first, dask chunks of a block rarely line up with the store chunks
+    ds = ds.drop_vars(static).load()
+    for name in ds.variables:
+        ds[name].encoding = {}
+
+    region = {time_dim: slice(region_start, region_start + ds.sizes[time_dim])}
+    ds.to_zarr(path, group=group, region=region)
+    return
+
+def append_dataset(ds, path, time_dim="time", group=None):
+    '''
+    Append ds along time to a zarr store written by write_dataset.
+    '''
+    for name in ds.variables:
+        ds[name].encoding = {}
+    ds.to_zarr(path, group=group, append_dim=time_dim)
+    return
+
+def get_output_path(path, output_format):
+    if output_format == "zarr":
+        return f"{os.path.splitext(path)[0]}.zarr"
+    return path
+
+def replace_path(tmp_path, path):
+    '''
+    Move a finished output into place, also for zarr store directories.
+    '''
+    if os.path.isdir(path):
+        old_path = f"{path}.old"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, path)
+    return
+
+def get_layout_path(path, access):
+    return f"{os.path.splitext(path)[0]}.{access}.zarr"
+
+def write_layout_copies(path, layouts=LAYOUTS, group=None):
+    '''
+    Rechunked zarr copies of a processed grid next to it, one per access pattern.
+    '''
+    with xr.open_dataset(path, group=group, chunks={}) as ds:
+        for access in layouts:
+            layout_path = get_layout_path(path, access)
+            print(f"Writing {access} copy to {layout_path}...")
+
+            tmp_path = f"{layout_path}.tmp"
+            write_dataset(ds, tmp_path, "zarr", access)
+            replace_path(tmp_path, layout_path)
+    return
+
+def open_for_query(path, times, lats, lons, match="date", window=None, time_dim="time"):
+    '''
+    Open whichever of path and its layout copies reads the fewest bytes to sample the points
+    (times, lats, lons) with point_sampler.sample_points (same match and window):
+    each copy reads every distinct storage chunk holding one of the points once.
+    '''
+    candidates = [str(path)]
+    for access in LAYOUTS:
+        layout_path = get_layout_path(str(path), access)
+        if os.path.exists(layout_path):
+            candidates.append(layout_path)
+
+    #--- The copies share the grid, so the points resolve to the same indices in all of them
+    with xr.open_dataset(candidates[0]) as ds:
+        indexers = point_sampler.get_point_indexers(ds, times, lats, lons, match, time_dim, window)[0]
+
+    read_bytes = {candidate: _estimate_read_bytes(candidate, indexers) for candidate in candidates}
+    best = min(candidates, key=read_bytes.get)
+    print(f"Reading {best} for {len(indexers[time_dim])} points ({read_bytes[best] / 1e6:.1f} MB)")
+
+    return xr.open_dataset(best)
+
+def get_table_dtypes(df, categories=(), coordinates=("latitude", "longitude", "cluster_latitude", "cluster_longitude")):
+    '''
+    Explicit dtypes for a processed table: float32 measurements and nullable int16 category codes
+    (missing samples as <NA>). Coordinates stay float64, datetimes and flags keep their dtypes.
+    '''
+    dtypes = {}
+    for name, dtype in df.dtypes.items():
+        if name in categories:
+            dtypes[name] = "Int16"
+        elif dtype.kind == "f" and name not in coordinates:
+            dtypes[name] = "float32"
+    return dtypes
+
+def write_table(df, path, table_formats=TABLE_FORMATS, dtypes=None):
+    '''
+    Write a dataframe next to path in each of table_formats ("parquet", "csv"), cast to dtypes first.
+    Integer casts raise on values outside the new dtype's range instead of wrapping around.
+    '''
+    if dtypes:
+        _check_integer_range(df, dtypes)
+        df = df.astype(dtypes)
+
+    stem = os.path.splitext(path)[0]
+    for table_format in table_formats:
+        if table_format == "parquet":
+            df.to_parquet(f"{stem}.parquet", index=False)
+        elif table_format == "csv":
+            df.to_csv(f"{stem}.csv", index=False)
+        else:
+            raise ValueError(f"Unknown table format: {table_format}")
+        print(f"Saved table to {stem}.{table_format}")
+    return
+
+#------------------------
+
+def _check_integer_range(df, dtypes):
+    for name, dtype in dtypes.items():
+        dtype = pd.api.types.pandas_dtype(dtype)
+        if dtype.kind not in "iu":
+            continue
+        info = np.iinfo(getattr(dtype, "numpy_dtype", dtype))
+        values = df[name]
+        outside = values.notna() & ((values < info.min) | (values > info.max))
+        if outside.any():
+            raise ValueError(
+                f"{name} has values outside the {dtype} range: {values[outside].unique()[:5].tolist()}"
+            )
+    return
+
+def _get_stored_chunks(da):
+    chunks = da.encoding.get("chunks") or da.encoding.get("chunksizes")
+    if chunks is None:
+        #--- Contiguous NetCDF variables are read by hyperslab, close to only the bytes asked for
+        return (1,) * da.ndim
+    return tuple(chunks)
+
+def _estimate_read_bytes(path, indexers):
+    with xr.open_dataset(path) as ds:
+        da = ds[max(ds.data_vars, key=lambda name: ds[name].ndim)]
+        chunks = [min(chunk, da.sizes[dim]) for dim, chunk in zip(da.dims, _get_stored_chunks(da))]
+
+    index = np.stack([np.asarray(indexers[dim]) for dim in da.dims])
+    if index.shape[1] == 0:
+        return 0
+    n_chunks = len(point_sampler.group_by_chunk(index, chunks)[1])
+
+    return n_chunks * np.prod(chunks) * da.dtype.itemsize
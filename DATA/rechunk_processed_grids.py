@@ -0,0 +1,32 @@
+#--- Map and time-series copies of the processed moisture and wind grids
+#------ Stages 3 and 6 read one pixel over time, the notebooks read whole maps,
+#------ readers pick the copy that suits the query with processed_store.open_for_query
+
+from dask.distributed import Client
+import time
+import processed_store
+
+def main():
+    start = time.time()
+
+    #--- Copies are written next to each grid as <name>.map.zarr and <name>.time_series.zarr
+    processed_paths = [
+        "DATA/processed/1_moisture_grid_2026-06-29.nc",
+        "DATA/processed/2_wind_grid_narr_2026-06-15.nc",
+    ]
+
+    with Client(dashboard_address="127.0.0.1:8787") as client:
+        print(client)
+
+        for processed_path in processed_paths:
+            processed_store.write_layout_copies(processed_path)
+
+    end = time.time()
+    print(f"Time to process: {end - start:.2f} seconds")
+
+    return
+
+#------------------------
+
+if __name__ == "__main__":
+    main()
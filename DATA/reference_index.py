@@ -0,0 +1,114 @@
+#--- Kerchunk reference index over the raw WLDAS, NARR and ERA5 files
+#------ Byte ranges of every chunk are scanned once per file (cached on size and mtime)
+#------ and combined into one JSON per source, which opens as a single lazy zarr dataset
+
+import xarray as xr
+import json
+import os
+from kerchunk.hdf import SingleHdf5ToZarr
+from kerchunk.netCDF3 import NetCDF3ToZarr
+from kerchunk.combine import MultiZarrToZarr
+import file_catalog
+
+REFERENCE_DIR = "DATA/processed/references"
+
+#------------------------
+
+def build_reference_index(source):
+    '''
+    Combine the per-file references of every catalog file into one index for the source.
+    '''
+    entries = file_catalog.query_files(source)
+    time_dim = file_catalog.SOURCES[source]["time_dim"]
+
+    print(f"Building reference index for {len(entries)} {source} files...")
+    file_refs = [_get_file_references(source, entry) for entry in entries]
+
+    #--- Grid coordinates are the same in every file, only time is concatenated
+    grid_names = list(file_catalog.get_catalog_grid(source))
+    mzz = MultiZarrToZarr(
+        file_refs,
+        concat_dims=[time_dim],
+        identical_dims=grid_names,
+        coo_map={time_dim: f"cf:{time_dim}"},
+    )
+    combined = mzz.translate()
+
+    os.makedirs(REFERENCE_DIR, exist_ok=True)
+    with open(_get_index_path(source), "w") as f:
+        json.dump(combined, f)
+    with open(_get_index_sources_path(source), "w") as f:
+        json.dump(_get_entry_keys(entries), f)
+
+    return _get_index_path(source)
+
+def open_reference_dataset(source, entries=None, chunks="auto", drop_variables=None):
+    '''
+    Open a source as one lazy dataset through its reference index, rebuilding the index if any file changed.
+    With entries, the dataset is subset to the times of those catalog entries.
+    '''
+    if _index_is_stale(source):
+        build_reference_index(source)
+
+    ds = xr.open_dataset(
+        "reference://",
+        engine="zarr",
+        chunks=chunks,
+        drop_variables=drop_variables,
+        backend_kwargs={
+            "consolidated": False,
+            "storage_options": {"fo": _get_index_path(source)},
+        },
+    )
+
+    if entries is not None:
+        time_dim = file_catalog.SOURCES[source]["time_dim"]
+        times = file_catalog.get_catalog_times(entries)
+        ds = ds.sel({time_dim: times.values.astype(ds[time_dim].dtype)})
+
+    return ds
+
+#------------------------
+
+def _get_file_references(source, entry):
+    cache_path = f"{REFERENCE_DIR}/{source}/{os.path.basename(entry['path'])}.json"
+    key = [entry["size"], entry["mtime"]]
+
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["key"] == key:
+            return cached["refs"]
+
+    with open(entry["path"], "rb") as f:
+        is_netcdf3 = f.read(3) == b"CDF"
+
+    if is_netcdf3:
+        refs = NetCDF3ToZarr(entry["path"], inline_threshold=300).translate()
+    else:
+        refs = SingleHdf5ToZarr(entry["path"], inline_threshold=300).translate()
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump({"key": key, "refs": refs}, f)
+
+    return refs
+
+def _get_entry_keys(entries):
+    return [[entry["path"], entry["size"], entry["mtime"]] for entry in entries]
+
+def _index_is_stale(source):
+    if not os.path.exists(_get_index_path(source)) or not os.path.exists(_get_index_sources_path(source)):
+        return True
+
+    with open(_get_index_sources_path(source)) as f:
+        indexed = json.load(f)
+    current = _get_entry_keys(file_catalog.query_files(source))
+
+    return indexed != current
+
+def _get_index_path(source):
+    return f"{REFERENCE_DIR}/{source}.json"
+
+def _get_index_sources_path(source):
+    return f"{REFERENCE_DIR}/{source}_files.json"
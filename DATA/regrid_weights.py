@@ -0,0 +1,77 @@
+#--- xESMF regridders with their weights cached on disk, shared by stages 4, 5 and 7
+#------ Weights are saved in DATA/processed/regrid_weights/, named by a hash of the source and target
+#------ coordinates and the method, so every stage regridding the same pair of grids reuses them
+#------ Source grids are first cut to the smallest index window covering the target (get_source_window),
+#------ so neither the weights nor the daily regridding touch source cells far outside the target region
+
+import numpy as np
+import hashlib
+import os
+import xesmf as xe
+
+WEIGHTS_DIR = "DATA/processed/regrid_weights"
+
+#------------------------
+
+def get_regridder(source_grid, target_grid, method="bilinear", periodic=False):
+    '''
+    xe.Regridder from source_grid to target_grid, with weights read from the cache when this pair
+    of grids and method was regridded before, otherwise computed and saved for next time.
+    '''
+    weights_path = get_weights_path(source_grid, target_grid, method, periodic)
+
+    if os.path.exists(weights_path):
+        print(f"Reusing regridding weights from {weights_path}")
+        return xe.Regridder(source_grid, target_grid, method=method, periodic=periodic, weights=weights_path)
+
+    print(f"Computing {method} regridding weights...")
+    regridder = xe.Regridder(source_grid, target_grid, method=method, periodic=periodic)
+
+    os.makedirs(WEIGHTS_DIR, exist_ok=True)
+    tmp_path = f"{weights_path}.tmp"
+    regridder.to_netcdf(tmp_path)
+    os.replace(tmp_path, weights_path)
+    print(f"Saved regridding weights to {weights_path}")
+
+    return regridder
+
+def get_source_window(source_grid, target_grid, pad=1):
+    '''
+    Index slices of the source grid's dimensions covering the target grid's lat/lon extent,
+    widened by one source grid spacing and pad cells so edge target points keep their interpolation cells.
+    '''
+    lat_name, lon_name = ("lat", "lon") if "lat" in source_grid else ("latitude", "longitude")
+    source_lat = source_grid[lat_name]
+    source_lon = source_grid[lon_name]
+
+    #--- Largest step between neighbouring source points, in degrees (across the dateline too)
+    steps = [
+        np.abs(np.diff(coord.values, axis=axis))
+        for coord in [source_lat, source_lon] for axis in range(coord.ndim)
+    ]
+    spacing = max(np.nanmax(np.minimum(step, 360 - step)) for step in steps)
+    lat_min, lat_max = target_grid["lat"].values.min() - spacing, target_grid["lat"].values.max() + spacing
+    lon_min, lon_max = target_grid["lon"].values.min() - spacing, target_grid["lon"].values.max() + spacing
+
+    lat_inside = (source_lat >= lat_min) & (source_lat <= lat_max)
+    lon_inside = (source_lon - lon_min) % 360 <= lon_max - lon_min #--- either longitude convention
+    inside = lat_inside & lon_inside
+
+    window = {}
+    for dim in inside.dims:
+        other_dims = [other for other in inside.dims if other != dim]
+        keep = np.flatnonzero(inside.any(other_dims).values if other_dims else inside.values)
+        if len(keep) == 0:
+            raise ValueError("Source grid doesn't overlap the target grid")
+        window[dim] = slice(int(max(keep[0] - pad, 0)), int(min(keep[-1] + pad + 1, source_grid.sizes[dim])))
+    return window
+
+def get_weights_path(source_grid, target_grid, method="bilinear", periodic=False):
+    key = hashlib.sha1()
+    for grid in [source_grid, target_grid]:
+        for name in sorted(grid.variables):
+            key.update(f"{name}{grid[name].dims}".encode())
+            key.update(np.ascontiguousarray(grid[name].values, dtype="float64").tobytes())
+    key.update(f"{method}{periodic}".encode())
+
+    return f"{WEIGHTS_DIR}/{method}_{key.hexdigest()[:16]}.nc"
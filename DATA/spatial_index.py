@@ -0,0 +1,55 @@
+#--- Nearest grid point lookups on curvilinear grids (e.g. the NARR Lambert grid with 2D lat/lon)
+#------ Grid points are put on the unit sphere and indexed with a KD-tree, built once per grid,
+#------ so all events are matched in one query by great-circle distance
+#------ Great-circle distances convert to chords on the sphere with get_chord, for radius queries on such trees
+
+import numpy as np
+import hashlib
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0
+
+_trees = {}
+
+#------------------------
+
+def get_grid_tree(lat2d, lon2d):
+    '''
+    KD-tree over the grid points on the unit sphere, cached for the grid.
+    '''
+    lat2d = np.asarray(lat2d, dtype="float64")
+    lon2d = np.asarray(lon2d, dtype="float64")
+    key = hashlib.sha1(lat2d.tobytes() + lon2d.tobytes()).hexdigest()
+
+    if key not in _trees:
+        _trees[key] = cKDTree(to_unit_sphere(lat2d.ravel(), lon2d.ravel()))
+    return _trees[key]
+
+def query_nearest(lat2d, lon2d, lats, lons):
+    '''
+    Nearest grid point to every (lat, lon) pair, as row and column index arrays
+    and the great-circle distance in km.
+    '''
+    tree = get_grid_tree(lat2d, lon2d)
+    points = to_unit_sphere(np.asarray(lats, dtype="float64"), np.asarray(lons, dtype="float64"))
+
+    chord, flat_index = tree.query(points)
+    iy, ix = np.unravel_index(flat_index, np.shape(lat2d))
+    distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+    return iy, ix, distance_km
+
+def get_chord(distance_km):
+    '''
+    Straight-line distance through the unit sphere for a great-circle distance, as queried on the tree.
+    '''
+    return 2 * np.sin(np.minimum(distance_km / EARTH_RADIUS_KM, np.pi) / 2)
+
+def to_unit_sphere(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack([
+        np.cos(lat) * np.cos(lon),
+        np.cos(lat) * np.sin(lon),
+        np.sin(lat),
+    ])
@@ -0,0 +1,84 @@
+#--- Wind source adapters shared by the stage 2 wind engine and the stage 3 hourly colocation
+#------ Each source is read through the reference index and renamed onto a common "time" dimension
+
+import numpy as np
+import file_catalog
+import reference_index
+
+#--- references: reference index sources to open (file_catalog.py)
+#------ components: u and v winds (speed from both) or one speed variable used as is
+#------ daytime_hours: hours (UTC) of the daily reduction, 00 UTC counts towards the day before
+#------ crop_to_land: crop to the American Southwest and the NARR land mask (NARR grid only)
+WIND_SOURCES = {
+    "narr": {
+        "name": "NARR",
+        "references": ["narr_uwnd", "narr_vwnd"],
+        "components": ["uwnd", "vwnd"],
+        "daytime_hours": [0, 12, 15, 18, 21],
+        "crop_to_land": True,
+    },
+    "era5": {
+        "name": "ERA-5",
+        "references": ["era5"],
+        "components": ["u10", "v10"],
+        "daytime_hours": [0, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23],
+        "crop_to_land": False,
+    },
+    "era5_land": {
+        "name": "ERA-5 Land",
+        "references": ["era5_land"],
+        "components": ["u10", "v10"],
+        "daytime_hours": [0, 12, 15, 18, 21],
+        "crop_to_land": False,
+    },
+    "era5_gust": {
+        "name": "ERA-5 gusts",
+        "references": ["era5_gust"],
+        #--- Kept as wind_speed so it matches with previous versions
+        "components": ["fg10"],
+        "daytime_hours": [0, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23],
+        "crop_to_land": False,
+    },
+}
+
+#------------------------
+
+def get_wind_components(source, chunks="auto"):
+    '''
+    Hourly wind components of a source (u and v, or a single speed variable) as DataArrays along "time".
+    With chunks=None they stay lazy backend arrays, so indexing only reads the chunks it touches.
+    '''
+    wind_source = WIND_SOURCES[source]
+
+    print(f"Opening data from {wind_source['name']}...")
+    references = wind_source["references"]
+    if len(references) == 1:
+        references = references * len(wind_source["components"])
+    datasets = {
+        reference: reference_index.open_reference_dataset(reference, chunks=chunks)
+        for reference in dict.fromkeys(references)
+    }
+
+    components = []
+    for reference, component in zip(references, wind_source["components"]):
+        time_dim = file_catalog.SOURCES[reference]["time_dim"]
+        components.append(datasets[reference][component].rename({time_dim: "time"}))
+
+    return components
+
+def get_wind_speeds(source, squared=False):
+    '''
+    Hourly wind speed of a source as a dataset with wind_speed along "time".
+    With squared, sources with u and v give wind_speed_squared instead, leaving the square root for later.
+    '''
+    components = get_wind_components(source)
+
+    if len(components) == 1:
+        ds_ws = components[0].to_dataset(name="wind_speed")
+    elif squared:
+        ds_ws = sum(component**2 for component in components).to_dataset(name="wind_speed_squared")
+    else:
+        print("Calculating wind speed...")
+        ds_ws = np.sqrt(sum(component**2 for component in components)).to_dataset(name="wind_speed")
+
+    return ds_ws